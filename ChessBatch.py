@@ -0,0 +1,376 @@
+'''
+Vectorized work on many positions at once with NumPy, for scoring large sets of positions.
+
+A BoardBatch holds N positions as an (N, 12) uint64 array of bitboards, in the same layout as
+GameState.pieces (piece index color*6 + piece type, bit row*8 + col), plus the side to move,
+castling rights and en passant square of each position. Every function below works on the whole
+batch with array operations; only loops over directions and over the pieces of one board remain.
+
+    batch = BoardBatch.from_fens(fens)
+    counts = legal_move_counts(batch)
+    scores = evaluate(batch)  # material and piece-square terms of ChessEvaluation
+    planes = batch.to_planes()  # (N, 12, 8, 8) uint8, e.g. as network input
+
+Needs numpy, unlike the rest of the engine.
+'''
+
+import numpy as np
+
+import ChessEngine
+from ChessBitboard import (WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, EMPTY,
+                           PIECE_NAMES, DIRECTIONS, ORTHOGONAL, DIAGONAL)
+from ChessEvaluation import DEFAULT_WEIGHTS, PIECE_PHASE, MAX_PHASE
+
+U64 = np.uint64
+FULL = U64(0xFFFFFFFFFFFFFFFF)
+ZERO = U64(0)
+NOT_COL_0 = U64(0xFEFEFEFEFEFEFEFE)
+NOT_COL_7 = U64(0x7F7F7F7F7F7F7F7F)
+NOT_COL_01 = U64(0xFCFCFCFCFCFCFCFC)
+NOT_COL_67 = U64(0x3F3F3F3F3F3F3F3F)
+ROW_2 = U64(0xFF << 16)  # black pawns after a single push from their start row
+ROW_5 = U64(0xFF << 40)  # white pawns after a single push
+LAST_ROWS = U64(0xFF | 0xFF << 56)
+
+# (shift, mask of squares a shifted bit may land on without wrapping round the board)
+_DIRECTION_SHIFTS = tuple((dr*8 + dc, NOT_COL_0 if dc == 1 else NOT_COL_7 if dc == -1 else FULL)
+                          for dr, dc in DIRECTIONS)
+_KNIGHT_SHIFTS = ((-17, NOT_COL_7), (-15, NOT_COL_0), (-10, NOT_COL_67), (-6, NOT_COL_01),
+                  (6, NOT_COL_67), (10, NOT_COL_01), (15, NOT_COL_7), (17, NOT_COL_0))
+# pawn captures towards row 0 for white, towards row 7 for black
+_PAWN_SHIFTS = (((-9, NOT_COL_7), (-7, NOT_COL_0)), ((7, NOT_COL_7), (9, NOT_COL_0)))
+
+def eval_table(weights=DEFAULT_WEIGHTS):
+    '''
+    (768, 3) int32 table of the middlegame score, endgame score and phase weight of every
+    piece index * 64 + square, scores positive for white, as GameState adds them up.
+    '''
+    table = np.zeros((12, 64, 3), dtype=np.int32)
+    table[:, :, 0] = weights.mg_piece_square
+    table[:, :, 1] = weights.eg_piece_square
+    table[:, :, 2] = np.array(PIECE_PHASE, dtype=np.int32)[:, None]
+    return table.reshape(12 * 64, 3)
+
+
+EVAL_TABLE = eval_table()
+
+if hasattr(np, "bitwise_count"):
+    def popcount(bb):
+        return np.bitwise_count(bb).astype(np.int64)
+else:  # numpy < 2.0
+    _BYTE_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+    def popcount(bb):
+        bb = np.ascontiguousarray(bb, dtype=np.uint64)
+        return _BYTE_COUNTS[bb.view(np.uint8).reshape(bb.shape + (8,))].sum(axis=-1)
+
+
+class BoardBatch():
+    def __init__(self, pieces, white_to_move=None, castling_rights=None, ep_square=None):
+        '''
+        pieces is an (N, 12) array of bitboards. Unless given, white is to move, nobody can castle
+        and there is no en passant square.
+        '''
+        self.pieces = np.ascontiguousarray(pieces, dtype=np.uint64).reshape(-1, 12)
+        n = len(self.pieces)
+        self.white_to_move = (np.ones(n, dtype=bool) if white_to_move is None
+                              else np.asarray(white_to_move, dtype=bool))
+        self.castling_rights = (np.zeros(n, dtype=np.uint8) if castling_rights is None
+                                else np.asarray(castling_rights, dtype=np.uint8))
+        self.ep_square = (np.full(n, ChessEngine.NO_SQUARE, dtype=np.int8) if ep_square is None
+                          else np.asarray(ep_square, dtype=np.int8))
+
+    def __len__(self):
+        return len(self.pieces)
+
+    def __getitem__(self, index):
+        '''Sub-batch of the positions picked by a slice, index array or mask.'''
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 or None)
+        return BoardBatch(self.pieces[index], self.white_to_move[index],
+                          self.castling_rights[index], self.ep_square[index])
+
+    @classmethod
+    def from_states(cls, states):
+        states = list(states)
+        return cls(np.array([gs.pieces for gs in states], dtype=np.uint64).reshape(-1, 12),
+                   [gs.white_to_move for gs in states],
+                   [gs.castling_rights for gs in states],
+                   [gs.ep_square for gs in states])
+
+    @classmethod
+    def from_fens(cls, fens):
+        '''Batch of FEN strings, parsed through one reused GameState.'''
+        gs = ChessEngine.GameState()
+        pieces = []
+        white_to_move = []
+        castling_rights = []
+        ep_square = []
+        for fen in fens:
+            gs.load_fen(fen)
+            pieces.append(gs.pieces)
+            white_to_move.append(gs.white_to_move)
+            castling_rights.append(gs.castling_rights)
+            ep_square.append(gs.ep_square)
+        return cls(np.array(pieces, dtype=np.uint64).reshape(-1, 12), white_to_move, castling_rights, ep_square)
+
+    @classmethod
+    def from_boards(cls, boards, white_to_move=None, castling_rights=None, ep_square=None):
+        '''Batch of 8x8 lists of piece names, the GameState.board layout.'''
+        names = np.asarray(boards, dtype="<U2").reshape(-1, 64)
+        bits = np.stack([names == name for name in PIECE_NAMES], axis=1)
+        return cls.from_planes(bits, white_to_move, castling_rights, ep_square)
+
+    @classmethod
+    def from_planes(cls, planes, white_to_move=None, castling_rights=None, ep_square=None):
+        '''Batch of (N, 12, 8, 8) piece planes, nonzero where the piece stands.'''
+        bits = (np.asarray(planes).reshape(-1, 12, 64) != 0).astype(np.uint8)
+        packed = np.packbits(bits, axis=2, bitorder="little")
+        pieces = np.ascontiguousarray(packed).view("<u8").reshape(-1, 12).astype(np.uint64)
+        return cls(pieces, white_to_move, castling_rights, ep_square)
+
+    def to_planes(self):
+        '''(N, 12, 8, 8) uint8 array, 1 where the piece stands.'''
+        raw = self.pieces.astype("<u8").view(np.uint8).reshape(-1, 12, 8)
+        return np.unpackbits(raw, axis=2, bitorder="little").reshape(-1, 12, 8, 8)
+
+    def to_mailboxes(self):
+        '''(N, 64) int8 array of the piece index on every square, EMPTY for none.'''
+        bits = self.to_planes().reshape(-1, 12, 64).astype(bool)
+        mailboxes = np.full((len(self), 64), EMPTY, dtype=np.int8)
+        for piece in range(12):
+            mailboxes[bits[:, piece]] = piece
+        return mailboxes
+
+    def to_boards(self):
+        '''List of 8x8 lists of piece names, the GameState.board layout.'''
+        names = np.array(PIECE_NAMES + ["--"])[self.to_mailboxes()]  # EMPTY picks "--"
+        return names.reshape(-1, 8, 8).tolist()
+
+    def to_states(self):
+        '''List of GameStates, one per position.'''
+        states = []
+        for i, mailbox in enumerate(self.to_mailboxes().tolist()):
+            gs = ChessEngine.GameState()
+            gs.load_mailbox(mailbox)
+            gs.white_to_move = bool(self.white_to_move[i])
+            gs.castling_rights = int(self.castling_rights[i])
+            gs.ep_square = int(self.ep_square[i])
+            gs.zobrist = gs.compute_zobrist()
+            states.append(gs)
+        return states
+
+    def side_pieces(self, to_move=True):
+        '''(N, 6) bitboards of the side to move, or of the other side.'''
+        first = self.white_to_move if to_move else ~self.white_to_move
+        return np.where(first[:, None], self.pieces[:, 0:6], self.pieces[:, 6:12])
+
+
+# ---------------------------------------------------------------------------
+# Set-wise attack generation on arrays of bitboards
+# ---------------------------------------------------------------------------
+
+def _shift(bb, amount):
+    return bb << U64(amount) if amount > 0 else bb >> U64(-amount)
+
+
+def _fill(gen, empty, direction):
+    '''Kogge-Stone fill: gen plus every square reached from it in direction over empty squares.'''
+    amount, mask = _DIRECTION_SHIFTS[direction]
+    empty = empty & mask
+    gen = gen | (empty & _shift(gen, amount))
+    empty = empty & _shift(empty, amount)
+    gen = gen | (empty & _shift(gen, amount * 2))
+    empty = empty & _shift(empty, amount * 2)
+    return gen | (empty & _shift(gen, amount * 4))
+
+
+def slide(gen, empty, direction):
+    '''Squares attacked by sliders on gen in direction, up to and including the first blocker.'''
+    amount, mask = _DIRECTION_SHIFTS[direction]
+    return _shift(_fill(gen, empty, direction), amount) & mask
+
+
+def knight_attacks(bb):
+    attacks = np.zeros_like(bb)
+    for amount, mask in _KNIGHT_SHIFTS:
+        attacks |= _shift(bb, amount) & mask
+    return attacks
+
+
+def king_attacks(bb):
+    attacks = np.zeros_like(bb)
+    for amount, mask in _DIRECTION_SHIFTS:
+        attacks |= _shift(bb, amount) & mask
+    return attacks
+
+
+def pawn_attacks(bb, white):
+    '''Squares attacked by pawns on bb, white or black per board as given by the bool array white.'''
+    attacks = []
+    for color in (WHITE, BLACK):
+        side = np.zeros_like(bb)
+        for amount, mask in _PAWN_SHIFTS[color]:
+            side |= _shift(bb, amount) & mask
+        attacks.append(side)
+    return np.where(white, attacks[WHITE], attacks[BLACK])
+
+
+def side_attacks(side, occupied, white):
+    '''Union of the squares attacked by one side, given its (N, 6) bitboards.'''
+    empty = ~occupied
+    attacks = (pawn_attacks(side[:, PAWN], white) | knight_attacks(side[:, KNIGHT]) |
+               king_attacks(side[:, KING]))
+    diagonal = side[:, BISHOP] | side[:, QUEEN]
+    orthogonal = side[:, ROOK] | side[:, QUEEN]
+    for direction in DIAGONAL:
+        attacks |= slide(diagonal, empty, direction)
+    for direction in ORTHOGONAL:
+        attacks |= slide(orthogonal, empty, direction)
+    return attacks
+
+
+# ---------------------------------------------------------------------------
+# Batch queries
+# ---------------------------------------------------------------------------
+
+def attack_maps(batch):
+    '''(N, 2) bitboards of the squares attacked by white and by black.'''
+    pieces = batch.pieces
+    occupied = np.bitwise_or.reduce(pieces, axis=1)
+    n = len(batch)
+    return np.stack([side_attacks(pieces[:, 0:6], occupied, np.ones(n, dtype=bool)),
+                     side_attacks(pieces[:, 6:12], occupied, np.zeros(n, dtype=bool))], axis=1)
+
+
+def in_check(batch):
+    '''Bool array, True where the side to move is in check.'''
+    us = batch.side_pieces(True)
+    them = batch.side_pieces(False)
+    occupied = np.bitwise_or.reduce(batch.pieces, axis=1)
+    return (side_attacks(them, occupied, ~batch.white_to_move) & us[:, KING]) != ZERO
+
+
+def legal_move_counts(batch):
+    '''
+    Number of legal moves of the side to move in every position, as GameState.get_valid_moves
+    would count them (each promotion piece is a move). Moves are counted, not listed: targets
+    are generated set-wise and limited by check and pin masks instead of making each move.
+    '''
+    white = batch.white_to_move
+    us = batch.side_pieces(True)
+    them = batch.side_pieces(False)
+    own = np.bitwise_or.reduce(us, axis=1)
+    enemy = np.bitwise_or.reduce(them, axis=1)
+    occupied = own | enemy
+    empty = ~occupied
+    king = us[:, KING]
+
+    # enemy attacks with our king lifted, so it cannot step back along a slider's ray
+    danger = side_attacks(them, occupied ^ king, ~white)
+    checkers = (knight_attacks(king) & them[:, KNIGHT]) | (pawn_attacks(king, white) & them[:, PAWN])
+    blocks = np.zeros_like(king)
+    pinned = np.zeros_like(king)
+    pins = []  # (pinned piece, line from the king to the pinner) per direction
+    for direction in range(8):
+        sliders = them[:, QUEEN] | (them[:, ROOK] if direction in ORTHOGONAL else them[:, BISHOP])
+        ray = slide(king, empty, direction)
+        hit = ray & sliders
+        checkers |= hit
+        blocks |= np.where(hit != ZERO, ray, ZERO)
+        blocker = ray & own
+        beyond = slide(blocker, empty, direction)
+        pinner = beyond & sliders
+        pinned_here = np.where(pinner != ZERO, blocker, ZERO)
+        pins.append((pinned_here, np.where(pinner != ZERO, ray | beyond, ZERO)))
+        pinned |= pinned_here
+    check_count = popcount(checkers)
+    check_mask = np.where(check_count == 0, FULL, np.where(check_count == 1, checkers | blocks, ZERO))
+
+    counts = popcount(king_attacks(king) & ~own & ~danger)
+
+    # castling, only out of check and through empty squares that are not attacked
+    rights = batch.castling_rights
+    for color, kingside, queenside, row in ((WHITE, ChessEngine.WHITE_KINGSIDE, ChessEngine.WHITE_QUEENSIDE, 7),
+                                            (BLACK, ChessEngine.BLACK_KINGSIDE, ChessEngine.BLACK_QUEENSIDE, 0)):
+        base = row * 8
+        side = (white if color == WHITE else ~white) & (check_count == 0)
+        passed = U64(3 << base + 5)  # f and g files
+        counts += side & (rights & kingside != 0) & (occupied & passed == ZERO) & (danger & passed == ZERO)
+        between = U64(7 << base + 1)  # b, c and d files
+        passed = U64(3 << base + 2)  # c and d files
+        counts += side & (rights & queenside != 0) & (occupied & between == ZERO) & (danger & passed == ZERO)
+
+    # pawns, set-wise per pin direction since a pinned pawn may only move along its pin
+    pawns = us[:, PAWN]
+    for group, line in [(pawns & ~pinned, FULL)] + [(pawns & pinned_here, line) for pinned_here, line in pins]:
+        allowed = check_mask & line
+        push_white = (group >> U64(8)) & empty
+        push_black = (group << U64(8)) & empty
+        single = np.where(white, push_white, push_black) & allowed
+        double = np.where(white, ((push_white & ROW_5) >> U64(8)) & empty,
+                          ((push_black & ROW_2) << U64(8)) & empty) & allowed
+        counts += popcount(double)
+        for targets in [single] + [np.where(white, _shift(group, white_shift) & white_mask,
+                                            _shift(group, black_shift) & black_mask) & enemy & allowed
+                                   for (white_shift, white_mask), (black_shift, black_mask)
+                                   in zip(*_PAWN_SHIFTS)]:
+            counts += popcount(targets & ~LAST_ROWS) + 4 * popcount(targets & LAST_ROWS)
+
+    # en passant: make the capture on the bitboards and look for any attack on the king
+    ep = batch.ep_square.astype(np.int64)
+    has_ep = ep >= 0
+    if has_ep.any():
+        ep_bb = np.where(has_ep, U64(1) << np.where(has_ep, ep, 0).astype(np.uint64), ZERO)
+        captured = np.where(white, ep_bb << U64(8), ep_bb >> U64(8)) & them[:, PAWN]
+        ep_bb = np.where(captured != ZERO, ep_bb, ZERO)
+        attackers = pawn_attacks(ep_bb, ~white) & pawns
+        diagonal = them[:, BISHOP] | them[:, QUEEN]
+        orthogonal = them[:, ROOK] | them[:, QUEEN]
+        while attackers.any():
+            attacker = attackers & (~attackers + U64(1))
+            attackers ^= attacker
+            after = ~(occupied ^ attacker ^ ep_bb ^ captured)
+            hit = ((knight_attacks(king) & them[:, KNIGHT]) |
+                   (pawn_attacks(king, white) & them[:, PAWN] & ~captured))
+            for direction in range(8):
+                hit |= slide(king, after, direction) & (orthogonal if direction in ORTHOGONAL else diagonal)
+            counts += (attacker != ZERO) & (hit == ZERO)
+
+    # knights and sliders, one piece of every board per pass
+    targets_allowed = ~own & check_mask
+    knights = us[:, KNIGHT]
+    diagonal = us[:, BISHOP] | us[:, QUEEN]
+    orthogonal = us[:, ROOK] | us[:, QUEEN]
+    rest = knights | diagonal | orthogonal
+    while rest.any():
+        piece = rest & (~rest + U64(1))  # lowest remaining piece, 0 on finished boards
+        rest ^= piece
+        targets = knight_attacks(piece & knights)
+        for direction in DIAGONAL:
+            targets |= slide(piece & diagonal, empty, direction)
+        for direction in ORTHOGONAL:
+            targets |= slide(piece & orthogonal, empty, direction)
+        targets &= targets_allowed
+        for pinned_here, line in pins:
+            targets = np.where(piece & pinned_here != ZERO, targets & line, targets)
+        counts += popcount(targets)
+    return counts
+
+
+def evaluate(batch, table=None, chunk_size=65536):
+    '''
+    Material plus tapered piece-square score of every position from the side to move's point of
+    view, the incremental part of ChessEvaluation (GameState.mg_score/eg_score/phase blended by
+    phase). table is an eval_table(), EVAL_TABLE (the default weights) if not given.
+    '''
+    table = EVAL_TABLE if table is None else np.asarray(table, dtype=np.int32)
+    scores = np.empty(len(batch), dtype=np.int64)
+    for start in range(0, len(batch), chunk_size):
+        raw = batch.pieces[start:start + chunk_size].astype("<u8").view(np.uint8).reshape(-1, 12, 8)
+        bits = np.unpackbits(raw, axis=2, bitorder="little").reshape(-1, 12 * 64)
+        mg, eg, phase = (bits @ table).astype(np.int64).T
+        phase = np.minimum(phase, MAX_PHASE)
+        scores[start:start + chunk_size] = mg*phase + eg*(MAX_PHASE - phase)
+    # the side to move's sign goes on before dividing, so mirrored positions round the same way
+    return np.where(batch.white_to_move, scores, -scores) // MAX_PHASE
@@ -0,0 +1,148 @@
+'''
+Bitboard helpers used by the engine.
+A bitboard is a python int used as a set of 64 squares, one bit per square.
+Squares are numbered row*8 + col, so bit 0 is a8 (board[0][0]) and bit 63 is h1 (board[7][7]),
+the same layout as GameState.board.
+'''
+
+WHITE = 0
+BLACK = 1
+
+PAWN = 0
+KNIGHT = 1
+BISHOP = 2
+ROOK = 3
+QUEEN = 4
+KING = 5
+
+EMPTY = -1  # mailbox value of an empty square
+
+COLOR_NAMES = 'wb'
+PIECE_LETTERS = 'pNBRQK'
+# piece index = color*6 + piece type, e.g. PIECE_NAMES[BLACK*6 + KNIGHT] == 'bN'
+PIECE_NAMES = [color + letter for color in COLOR_NAMES for letter in PIECE_LETTERS]
+NAME_TO_PIECE = {name: i for i, name in enumerate(PIECE_NAMES)}
+
+FULL = (1 << 64) - 1
+SQUARE_BB = [1 << sq for sq in range(64)]
+NOT_COL_0 = 0xFEFEFEFEFEFEFEFE  # every square but the a file
+NOT_COL_7 = 0x7F7F7F7F7F7F7F7F  # every square but the h file
+
+
+def square(row, col):
+    return row*8 + col
+
+
+def lsb(bb):
+    '''Index of the lowest set bit.'''
+    return (bb & -bb).bit_length() - 1
+
+
+def msb(bb):
+    '''Index of the highest set bit.'''
+    return bb.bit_length() - 1
+
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+else:  # python < 3.10
+    def popcount(bb):
+        return bin(bb).count('1')
+
+
+def iter_squares(bb):
+    '''Yield the index of every set bit, lowest first.'''
+    while bb:
+        b = bb & -bb
+        yield b.bit_length() - 1
+        bb ^= b
+
+
+def to_string(bb):
+    '''Debug view of a bitboard, rank 8 on top.'''
+    rows = []
+    for row in range(8):
+        rows.append(' '.join('1' if bb >> (row*8 + col) & 1 else '.' for col in range(8)))
+    return '\n'.join(rows)
+
+
+# ---------------------------------------------------------------------------
+# Attack tables, built once at import.
+# ---------------------------------------------------------------------------
+
+# ray directions as (row step, col step), in the order GameState.find_pinsAndChecks walks them:
+# 0-3 orthogonal, 4-7 diagonal
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+ORTHOGONAL = (0, 1, 2, 3)
+DIAGONAL = (4, 5, 6, 7)
+# directions that run towards higher square indices, so the nearest blocker is the lowest bit
+POSITIVE = (False, False, True, True, False, False, True, True)
+DIRECTION_INDEX = {d: i for i, d in enumerate(DIRECTIONS)}
+OPPOSITE = (2, 3, 0, 1, 7, 6, 5, 4)
+
+
+def _offsets_table(offsets):
+    table = []
+    for sq in range(64):
+        row, col = sq >> 3, sq & 7
+        bb = 0
+        for dr, dc in offsets:
+            r, c = row + dr, col + dc
+            if 0 <= r < 8 and 0 <= c < 8:
+                bb |= 1 << (r*8 + c)
+        table.append(bb)
+    return table
+
+
+def _ray_table(dr, dc):
+    table = []
+    for sq in range(64):
+        r, c = (sq >> 3) + dr, (sq & 7) + dc
+        bb = 0
+        while 0 <= r < 8 and 0 <= c < 8:
+            bb |= 1 << (r*8 + c)
+            r += dr
+            c += dc
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _offsets_table(((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2)))
+KING_ATTACKS = _offsets_table(DIRECTIONS)
+# PAWN_ATTACKS[color][sq]: squares a pawn of that color on sq attacks
+PAWN_ATTACKS = [_offsets_table(((-1, -1), (-1, 1))), _offsets_table(((1, -1), (1, 1)))]
+# RAYS[direction][sq]: every square from sq (exclusive) to the edge of the board
+RAYS = [_ray_table(dr, dc) for dr, dc in DIRECTIONS]
+
+
+def ray_attacks(direction, sq, occupied):
+    '''Squares attacked from sq along one direction, up to and including the first blocker.'''
+    ray = RAYS[direction][sq]
+    blockers = ray & occupied
+    if blockers:
+        if POSITIVE[direction]:
+            ray ^= RAYS[direction][(blockers & -blockers).bit_length() - 1]
+        else:
+            ray ^= RAYS[direction][blockers.bit_length() - 1]
+    return ray
+
+
+def rook_attacks(sq, occupied):
+    return (ray_attacks(0, sq, occupied) | ray_attacks(1, sq, occupied) |
+            ray_attacks(2, sq, occupied) | ray_attacks(3, sq, occupied))
+
+
+def bishop_attacks(sq, occupied):
+    return (ray_attacks(4, sq, occupied) | ray_attacks(5, sq, occupied) |
+            ray_attacks(6, sq, occupied) | ray_attacks(7, sq, occupied))
+
+
+def queen_attacks(sq, occupied):
+    return rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+
+
+def pawn_attacks(pawns, color):
+    '''Squares attacked by all pawns of color on the pawns bitboard at once.'''
+    if color == WHITE:
+        return ((pawns >> 9) & NOT_COL_7) | ((pawns >> 7) & NOT_COL_0)
+    return ((pawns << 7) & NOT_COL_7) | ((pawns << 9) & NOT_COL_0 & FULL)
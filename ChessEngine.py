@@ -4,314 +4,920 @@ Determining valid moves at current state.
 It will keep move log.
 '''
 
+import random
+
+from ChessBitboard import (WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, EMPTY, FULL,
+                           PIECE_LETTERS, PIECE_NAMES, NAME_TO_PIECE, SQUARE_BB, iter_squares, lsb, msb, popcount,
+                           POSITIVE, RAYS, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS,
+                           rook_attacks, bishop_attacks, pawn_attacks)
+from ChessEvaluation import DEFAULT_WEIGHTS, PIECE_PHASE
+
+# move flags, stored in bits 12-15 of a move code
+QUIET = 0
+DOUBLE_PUSH = 1
+KING_CASTLE = 2
+QUEEN_CASTLE = 3
+CAPTURE = 4
+EN_PASSANT = 5
+PROMOTION = 8  # the low 2 bits then pick the piece, CAPTURE may be set as well
+PROMOTE_KNIGHT = 8
+PROMOTE_BISHOP = 9
+PROMOTE_ROOK = 10
+PROMOTE_QUEEN = 11
+PROMOTION_PIECES = (KNIGHT, BISHOP, ROOK, QUEEN)
+
+# castling rights bits
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = 15
+NO_SQUARE = -1  # ep_square when there is no en passant capture
+
+# which moves to generate, for staged move generation in search
+GEN_ALL = 0
+GEN_NOISY = 1  # captures, en passant and promotions
+GEN_QUIET = 2  # everything else, castling included
+
+# CASTLING_MASK[sq]: rights kept when a move starts or ends on sq
+CASTLING_MASK = [ALL_CASTLING] * 64
+CASTLING_MASK[60] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)  # e1
+CASTLING_MASK[63] &= ~WHITE_KINGSIDE  # h1
+CASTLING_MASK[56] &= ~WHITE_QUEENSIDE  # a1
+CASTLING_MASK[4] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)  # e8
+CASTLING_MASK[7] &= ~BLACK_KINGSIDE  # h8
+CASTLING_MASK[0] &= ~BLACK_QUEENSIDE  # a8
+# rook (start, end) square for a castling move, keyed by the king's end square
+CASTLING_ROOK = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+# (right, king home square, rook home square); a right is only kept with both pieces at home
+CASTLING_HOMES = ((WHITE_KINGSIDE, 60, 63), (WHITE_QUEENSIDE, 60, 56), (BLACK_KINGSIDE, 4, 7), (BLACK_QUEENSIDE, 4, 0))
+
+# FEN piece letters by piece index, and back
+FEN_LETTERS = 'PNBRQKpnbrqk'
+FEN_PIECES = {letter: piece for piece, letter in enumerate(FEN_LETTERS)}
+CASTLING_LETTERS = (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE), ('k', BLACK_KINGSIDE), ('q', BLACK_QUEENSIDE))
+CASTLING_BITS = dict(CASTLING_LETTERS)
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Zobrist keys, fixed seed so hashes are stable between runs and processes
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = [[_zobrist_random.getrandbits(64) for sq in range(64)] for piece in range(12)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for rights in range(16)]
+ZOBRIST_EP_FILE = [_zobrist_random.getrandbits(64) for col in range(8)]
+
+START_BOARD = [
+    ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
+    ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
+    ["--", "--", "--", "--", "--", "--", "--", "--"],
+    ["--", "--", "--", "--", "--", "--", "--", "--"],
+    ["--", "--", "--", "--", "--", "--", "--", "--"],
+    ["--", "--", "--", "--", "--", "--", "--", "--"],
+    ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
+    ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
+]
+
+
 class GameState():
-    def __init__(self):
+    def __init__(self, fen=None, move_cache=None):
         '''
-        Board is an 8x8 2d list, each element in list has 2 characters.
+        Starts from the initial position, or from fen if given.
+        move_cache, a ChessMoveCache.MoveCache, makes get_valid_move_codes reuse the moves of
+        positions it has already seen.
+
+        The material plus piece-square sums of ChessEvaluation are kept in self.mg_score and
+        self.eg_score (white minus black) and the game phase in self.phase, updated with every
+        piece put on or taken off the board.
+
+        The position is stored as bitboards: one 64-bit int per piece (self.pieces, indexed by
+        color*6 + piece type), one per color (self.colors) and the union of both (self.occupied).
+        self.mailbox keeps the piece index of every square (EMPTY if none) for O(1) lookups.
+
+        self.board is a derived 8x8 2d list view for the UI, each element has 2 characters.
         The first character represtents the color of the piece: 'b' or 'w'.
         The second character represtents the type of the piece: 'R', 'N', 'B', 'Q', 'K' or 'p'.
         "--" represents an empty space with no piece.
         '''
-        self.board = [
-            ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
-            ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
-            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
-        ]
+        self.pieces = [0] * 12
+        self.colors = [0, 0]
+        self.occupied = 0
+        self.mailbox = [EMPTY] * 64
+        self._board = None  # cached board view, rebuilt lazily after the position changes
+        self.eval_weights = DEFAULT_WEIGHTS
+        self.mg_table = DEFAULT_WEIGHTS.mg_piece_square
+        self.eg_table = DEFAULT_WEIGHTS.eg_piece_square
+        self.mg_score = self.eg_score = self.phase = 0
+        self.bind_move_functions()
+        self.white_to_move = True
+        self.castling_rights = ALL_CASTLING
+        self.ep_square = NO_SQUARE  # square a pawn can capture en passant onto
+        self.halfmove_clock = 0  # plies since the last capture or pawn move
+        self.fullmove_number = 1
+        self.move_log = []  # move codes
+        # irreversible state before each move in move_log:
+        # (captured piece, castling rights, ep square, halfmove clock, white king sq | black king sq << 6, zobrist key)
+        self.history = []
+        self.board = START_BOARD  # sets the zobrist key too
+        # masks of the side to move, set once per position by find_pinsAndChecks
+        self.in_check = False
+        self.checkers = 0  # enemy pieces giving check
+        self.check_mask = FULL  # squares a non-king move must end on: all, the checker and the line to it, or none
+        self.pinned = 0  # own pieces pinned to the king
+        self.pin_lines = {}  # pinned square -> squares from the king to the pinner, the only ones it may move to
+        self.attacked = 0  # squares the enemy attacks, looking through our king
+        self.gen_targets = (FULL, 0, FULL)  # target squares of piece moves per GEN_* kind
+        self.attack_key = None  # zobrist key of the position the masks belong to
+        self.move_cache = move_cache
+        if fen is not None:
+            self.load_fen(fen)
+
+    def bind_move_functions(self):
+        '''Bind the per-piece move generators, again whenever the class methods are swapped (ChessProfile).'''
         self.move_functions = {"p": self.get_pawn_moves, "R": self.get_rook_moves, "N": self.get_knight_moves,
                                "B": self.get_bishop_moves, "Q": self.get_queen_moves, "K": self.get_king_moves}
-        self.white_to_move = True
+
+    @property
+    def board(self):
+        if self._board is None:
+            mailbox = self.mailbox
+            self._board = [[PIECE_NAMES[mailbox[row*8 + col]] if mailbox[row*8 + col] != EMPTY else "--"
+                            for col in range(8)] for row in range(8)]
+        return self._board
+
+    @board.setter
+    def board(self, board):
+        '''Load the bitboards from an 8x8 2d list of piece names.'''
+        self.load_mailbox([NAME_TO_PIECE[name] if name != "--" else EMPTY for row in board for name in row])
+
+    def load_mailbox(self, mailbox):
+        '''
+        Set up the pieces from 64 piece indices (EMPTY for none).
+        Side to move, castling rights and the rest of the state are left as they are; the
+        zobrist key is recomputed over all of it.
+        '''
+        self.pieces = [0] * 12
+        self.colors = [0, 0]
+        self.mailbox = [EMPTY] * 64
+        self.zobrist = 0
+        self.mg_score = self.eg_score = self.phase = 0
+        for sq in range(64):
+            if mailbox[sq] != EMPTY:
+                self.put_piece(mailbox[sq], sq)
+        self.occupied = self.colors[WHITE] | self.colors[BLACK]
+        self._board = None
+        white_king = self.pieces[WHITE*6 + KING]
+        black_king = self.pieces[BLACK*6 + KING]
+        self.king_sq = [lsb(white_king) if white_king else NO_SQUARE,
+                        lsb(black_king) if black_king else NO_SQUARE]
+        self.zobrist = self.compute_zobrist()
+        self.attack_key = None  # the check and pin masks belong to the old pieces
+
+    @property
+    def whiteKing_loc(self):
+        return divmod(self.king_sq[WHITE], 8)
+
+    @property
+    def blackKing_loc(self):
+        return divmod(self.king_sq[BLACK], 8)
+
+    def copy(self):
+        '''Independent copy of the position and its move history, e.g. to hand to another thread.
+        The move cache, if any, is shared.'''
+        gs = GameState()
+        gs.pieces = list(self.pieces)
+        gs.colors = list(self.colors)
+        gs.occupied = self.occupied
+        gs.mailbox = list(self.mailbox)
+        gs._board = None
+        gs.king_sq = list(self.king_sq)
+        gs.white_to_move = self.white_to_move
+        gs.castling_rights = self.castling_rights
+        gs.ep_square = self.ep_square
+        gs.halfmove_clock = self.halfmove_clock
+        gs.fullmove_number = self.fullmove_number
+        gs.move_log = list(self.move_log)
+        gs.history = list(self.history)
+        gs.zobrist = self.zobrist
+        gs.move_cache = self.move_cache
+        gs.eval_weights = self.eval_weights
+        gs.mg_table = self.mg_table
+        gs.eg_table = self.eg_table
+        gs.mg_score = self.mg_score
+        gs.eg_score = self.eg_score
+        gs.phase = self.phase
+        return gs
+
+    def load_fen(self, fen):
+        '''
+        Set up the position from a FEN string, clearing the move history.
+        Missing trailing fields default to white to move, no castling, no en passant, 0 1.
+        Raises ValueError, leaving the position as it was, for a malformed FEN, one without
+        exactly one king per side or one whose en passant square has no pawn that just double
+        pushed. Castling rights whose king or rook has left its home square are dropped.
+        '''
+        fields = fen.split()
+        if not fields:
+            raise ValueError("empty FEN")
+        pieces = [0] * 12
+        mailbox = [EMPTY] * 64
+        key = 0
+        mg_table = self.mg_table
+        eg_table = self.eg_table
+        mg = eg = phase = 0
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError("bad FEN placement: " + fields[0])
+        for row, rank in enumerate(ranks):
+            sq = row*8
+            end = sq + 8
+            for char in rank:
+                piece = FEN_PIECES.get(char)
+                if piece is not None:
+                    if sq >= end:
+                        raise ValueError("bad FEN placement: " + fields[0])
+                    pieces[piece] |= SQUARE_BB[sq]
+                    mailbox[sq] = piece
+                    key ^= ZOBRIST_PIECES[piece][sq]
+                    mg += mg_table[piece][sq]
+                    eg += eg_table[piece][sq]
+                    phase += PIECE_PHASE[piece]
+                    sq += 1
+                elif '1' <= char <= '8':
+                    sq += ord(char) - 48
+                else:
+                    raise ValueError("bad FEN placement: " + fields[0])
+            if sq != end:
+                raise ValueError("bad FEN placement: " + fields[0])
+        if popcount(pieces[WHITE*6 + KING]) != 1 or popcount(pieces[BLACK*6 + KING]) != 1:
+            raise ValueError("FEN needs one king per side: " + fields[0])
+
+        count = len(fields)
+        if count > 1 and fields[1] not in ('w', 'b'):
+            raise ValueError("bad FEN side to move: " + fields[1])
+        white_to_move = count < 2 or fields[1] == 'w'
+        rights = 0
+        if count > 2 and fields[2] != '-':
+            for char in fields[2]:
+                bit = CASTLING_BITS.get(char)
+                if bit is None or rights & bit:
+                    raise ValueError("bad FEN castling rights: " + fields[2])
+                rights |= bit
+        for bit, king_home, rook_home in CASTLING_HOMES:
+            color = WHITE if bit & (WHITE_KINGSIDE | WHITE_QUEENSIDE) else BLACK
+            if mailbox[king_home] != color*6 + KING or mailbox[rook_home] != color*6 + ROOK:
+                rights &= ~bit  # a right the pieces no longer have
+        ep_square = NO_SQUARE
+        if count > 3 and fields[3] != '-':
+            name = fields[3]
+            if len(name) != 2 or name[0] not in Move.files_to_cols or name[1] != ('6' if white_to_move else '3'):
+                raise ValueError("bad FEN en passant square: " + name)
+            ep_square = square_index(name)
+            # the pawn that just made the double push, with the squares it passed still empty
+            pushed, start = (ep_square + 8, ep_square - 8) if white_to_move else (ep_square - 8, ep_square + 8)
+            if mailbox[pushed] != (BLACK if white_to_move else WHITE)*6 + PAWN or \
+                    mailbox[ep_square] != EMPTY or mailbox[start] != EMPTY:
+                raise ValueError("FEN en passant square without a double pushed pawn: " + name)
+        halfmove_clock = int(fields[4]) if count > 4 else 0
+        fullmove_number = int(fields[5]) if count > 5 else 1
+        if halfmove_clock < 0 or fullmove_number < 1:
+            raise ValueError("bad FEN move clocks: " + ' '.join(fields[4:6]))
+
+        self.pieces = pieces
+        self.colors = [pieces[0] | pieces[1] | pieces[2] | pieces[3] | pieces[4] | pieces[5],
+                       pieces[6] | pieces[7] | pieces[8] | pieces[9] | pieces[10] | pieces[11]]
+        self.occupied = self.colors[WHITE] | self.colors[BLACK]
+        self.mailbox = mailbox
+        self._board = None
+        self.mg_score = mg
+        self.eg_score = eg
+        self.phase = phase
+        self.king_sq = [lsb(pieces[WHITE*6 + KING]), lsb(pieces[BLACK*6 + KING])]
+        self.white_to_move = white_to_move
+        self.castling_rights = rights
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
         self.move_log = []
-        self.whiteKing_loc = (7,4)
-        self.blackKing_loc = (0,4)
-        self.in_check = False
-        self.pins = []
-        self.checks = []
+        self.history = []
+
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[rights]
+        if self.ep_square != NO_SQUARE and self.ep_capturable(self.ep_square):
+            key ^= ZOBRIST_EP_FILE[self.ep_square & 7]
+        self.zobrist = key
+
+    def to_fen(self):
+        mailbox = self.mailbox
+        rows = []
+        for row in range(8):
+            text = ''
+            empty = 0
+            for sq in range(row*8, row*8 + 8):
+                piece = mailbox[sq]
+                if piece == EMPTY:
+                    empty += 1
+                else:
+                    if empty:
+                        text += str(empty)
+                        empty = 0
+                    text += FEN_LETTERS[piece]
+            if empty:
+                text += str(empty)
+            rows.append(text)
+        castling = ''.join(letter for letter, bit in CASTLING_LETTERS if self.castling_rights & bit) or '-'
+        ep = square_name(self.ep_square) if self.ep_square != NO_SQUARE else '-'
+        return "{} {} {} {} {} {}".format('/'.join(rows), 'w' if self.white_to_move else 'b', castling, ep,
+                                          self.halfmove_clock, self.fullmove_number)
+
+    def load_epd(self, epd):
+        '''
+        Set up the position from an EPD line and return its operations as a dict of
+        opcode -> operand string, e.g. {'bm': 'Nf3', 'id': 'WAC.001'}.
+        The hmvc and fmvn operations set the move clocks. A full FEN line is read too: two
+        integers after the position fields are taken as the clocks, not as operations.
+        '''
+        fields = epd.split(None, 4)
+        if len(fields) < 4:
+            raise ValueError("EPD needs 4 position fields: " + epd)
+        rest = fields[4] if len(fields) > 4 else ''
+        clocks = rest.split(None, 2)
+        if len(clocks) >= 2 and all(clock.lstrip('-').isdigit() for clock in clocks[:2]):
+            self.load_fen(' '.join(fields[:4] + clocks[:2]))
+            rest = clocks[2] if len(clocks) > 2 else ''
+        else:
+            self.load_fen(' '.join(fields[:4]))
+        operations = parse_epd_operations(rest) if rest else {}
+        if 'hmvc' in operations:
+            self.halfmove_clock = int(operations['hmvc'])
+        if 'fmvn' in operations:
+            self.fullmove_number = int(operations['fmvn'])
+        return operations
+
+    def to_epd(self, operations=None):
+        '''EPD of the position, with operations given as a dict of opcode -> operand string.'''
+        epd = self.to_fen().rsplit(' ', 2)[0]
+        if operations:
+            for opcode, operand in operations.items():
+                if operand is None or operand == '':
+                    epd += ' {};'.format(opcode)
+                elif ' ' in operand or ';' in operand:
+                    epd += ' {} "{}";'.format(opcode, operand)
+                else:
+                    epd += ' {} {};'.format(opcode, operand)
+        return epd
+
+    def pack(self):
+        '''
+        Compact bytes form of the position for sending to other processes: 64 bytes of
+        piece index + 1, then side to move, castling rights, ep square + 1, halfmove clock
+        and a 2 byte fullmove number. The move history is not included.
+        '''
+        return bytes([piece + 1 for piece in self.mailbox] +
+                     [self.white_to_move, self.castling_rights, self.ep_square + 1, min(self.halfmove_clock, 255)]) + \
+            self.fullmove_number.to_bytes(2, 'little')
+
+    @classmethod
+    def unpack(cls, data):
+        '''GameState from the output of pack().'''
+        gs = cls()
+        gs.load_mailbox([piece - 1 for piece in data[:64]])
+        gs.white_to_move = bool(data[64])
+        gs.castling_rights = data[65]
+        gs.ep_square = data[66] - 1
+        gs.halfmove_clock = data[67]
+        gs.fullmove_number = int.from_bytes(data[68:70], 'little')
+        gs.zobrist = gs.compute_zobrist()
+        return gs
+
+    @property
+    def zobrist_key(self):
+        '''64-bit hash of the position, kept up to date by make_move / undo_move.'''
+        return self.zobrist
+
+    def compute_zobrist(self):
+        '''
+        Hash the position from scratch.
+        Needed after setting white_to_move, castling_rights or ep_square directly.
+        '''
+        key = 0
+        for sq in range(64):
+            if self.mailbox[sq] != EMPTY:
+                key ^= ZOBRIST_PIECES[self.mailbox[sq]][sq]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castling_rights]
+        if self.ep_square != NO_SQUARE and self.ep_capturable(self.ep_square):
+            key ^= ZOBRIST_EP_FILE[self.ep_square & 7]
+        return key
+
+    def set_eval_weights(self, weights):
+        '''Switch the incremental evaluation terms to another ChessEvaluation.EvalWeights.'''
+        self.eval_weights = weights
+        self.mg_table = weights.mg_piece_square
+        self.eg_table = weights.eg_piece_square
+        self.mg_score, self.eg_score, self.phase = self.compute_eval_terms()
+
+    def compute_eval_terms(self):
+        '''(mg score, eg score, phase) from scratch, as put_piece/remove_piece keep them.'''
+        mg = eg = phase = 0
+        for sq in range(64):
+            piece = self.mailbox[sq]
+            if piece != EMPTY:
+                mg += self.mg_table[piece][sq]
+                eg += self.eg_table[piece][sq]
+                phase += PIECE_PHASE[piece]
+        return mg, eg, phase
+
+    def ep_capturable(self, ep):
+        '''
+        True if a pawn of the side to move attacks ep. The en passant file only goes into the
+        hash when it does, so positions that only differ by a dead ep square hash the same.
+        '''
+        us = WHITE if self.white_to_move else BLACK
+        return bool(PAWN_ATTACKS[us ^ 1][ep] & self.pieces[us*6 + PAWN])
+
+    def is_repetition(self):
+        '''True if the current position already occurred since the last capture or pawn move.'''
+        return self.repetition_count(2) >= 2
+
+    def repetition_count(self, limit=3):
+        '''
+        How often the current position occurred since the last capture or pawn move, this time
+        included. Counting stops at limit, 3 for a threefold repetition.
+        '''
+        history = self.history
+        key = self.zobrist
+        count = 1
+        stop = max(len(history) - self.halfmove_clock, 0)
+        for i in range(len(history) - 2, stop - 1, -2):
+            if history[i][5] == key:
+                count += 1
+                if count >= limit:
+                    break
+        return count
+
+    def put_piece(self, piece, sq):
+        bit = SQUARE_BB[sq]
+        self.pieces[piece] |= bit
+        self.colors[piece >= 6] |= bit
+        self.occupied |= bit
+        self.mailbox[sq] = piece
+        self.zobrist ^= ZOBRIST_PIECES[piece][sq]
+        self.mg_score += self.mg_table[piece][sq]
+        self.eg_score += self.eg_table[piece][sq]
+        self.phase += PIECE_PHASE[piece]
+        self._board = None
+
+    def remove_piece(self, sq):
+        piece = self.mailbox[sq]
+        if piece != EMPTY:
+            mask = ~SQUARE_BB[sq]
+            self.pieces[piece] &= mask
+            self.colors[piece >= 6] &= mask
+            self.occupied &= mask
+            self.mailbox[sq] = EMPTY
+            self.zobrist ^= ZOBRIST_PIECES[piece][sq]
+            self.mg_score -= self.mg_table[piece][sq]
+            self.eg_score -= self.eg_table[piece][sq]
+            self.phase -= PIECE_PHASE[piece]
+            self._board = None
+        return piece
 
     def make_move(self, move):
+        '''Play a move, given as a Move or as its packed int code.'''
+        if move.__class__ is Move:
+            move = move.code
+        start = move & 63
+        end = (move >> 6) & 63
+        flags = move >> 12
+        king_sq = self.king_sq
+        captured = self.mailbox[end]
+        self.history.append((captured, self.castling_rights, self.ep_square, self.halfmove_clock,
+                             king_sq[WHITE] | king_sq[BLACK] << 6, self.zobrist))
+        # hash out the old castling rights and en passant file while the position is still intact
+        key = ZOBRIST_CASTLING[self.castling_rights]
+        if self.ep_square != NO_SQUARE and self.ep_capturable(self.ep_square):
+            key ^= ZOBRIST_EP_FILE[self.ep_square & 7]
         # make the start sq empty
-        self.board[move.start_row][move.start_col] = '--'
+        piece = self.remove_piece(start)
+        color = BLACK if piece >= 6 else WHITE
         # moving the piece
-        self.board[move.end_row][move.end_col]  = move.piece_moved
+        if captured != EMPTY:
+            self.remove_piece(end)
+        if flags & PROMOTION:
+            self.put_piece(color*6 + PROMOTION_PIECES[flags & 3], end)
+        else:
+            self.put_piece(piece, end)
+
+        if flags == EN_PASSANT:  # the captured pawn is beside the start square, not on end
+            self.remove_piece((start & 56) | (end & 7))
+        elif flags == KING_CASTLE or flags == QUEEN_CASTLE:
+            rook_start, rook_end = CASTLING_ROOK[end]
+            self.put_piece(self.remove_piece(rook_start), rook_end)
+        if piece % 6 == KING:
+            king_sq[color] = end
+
+        # put_piece/remove_piece hashed the piece squares, now the rest of the state
+        key ^= ZOBRIST_BLACK_TO_MOVE
+        self.castling_rights &= CASTLING_MASK[start] & CASTLING_MASK[end]
+        key ^= ZOBRIST_CASTLING[self.castling_rights]
+        if flags == DOUBLE_PUSH:
+            self.ep_square = (start + end) >> 1
+            if PAWN_ATTACKS[color][self.ep_square] & self.pieces[(color ^ 1)*6 + PAWN]:
+                key ^= ZOBRIST_EP_FILE[self.ep_square & 7]
+        else:
+            self.ep_square = NO_SQUARE
+        self.zobrist ^= key
+        if piece % 6 == PAWN or captured != EMPTY:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if color == BLACK:
+            self.fullmove_number += 1
         
         self.move_log.append(move)
         
         self.white_to_move = not self.white_to_move 
 
-    def get_possible_moves(self):
+    def get_possible_moves(self, moves=None, kind=GEN_ALL):
         """
-        All moves without considering checks.
+        Moves of every piece of the side to move, as packed int codes, limited by the check and
+        pin masks set by find_pinsAndChecks. kind picks all, noisy or quiet moves.
+        Moves are appended to the moves buffer if one is given.
         """
-        moves = []
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                turn = self.board[row][col][0]
-                if (turn == "w" and self.white_to_move) or (turn == "b" and not self.white_to_move):
-                    piece = self.board[row][col][1]
-                    self.move_functions[piece](row, col, moves)  # calls appropriate move function based on piece type
+        if moves is None:
+            moves = []
+        mailbox = self.mailbox
+        for sq in iter_squares(self.colors[WHITE if self.white_to_move else BLACK]):
+            piece = PIECE_LETTERS[mailbox[sq] % 6]
+            self.move_functions[piece](sq, moves, kind)  # calls appropriate move function based on piece type
         return moves
 
     def undo_move(self):
         if len(self.move_log) != 0: #make sure the move log is not 0
             move = self.move_log.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            captured, self.castling_rights, self.ep_square, self.halfmove_clock, kings, zobrist = self.history.pop()
+            self.king_sq[WHITE] = kings & 63
+            self.king_sq[BLACK] = kings >> 6
+            start = move & 63
+            end = (move >> 6) & 63
+            flags = move >> 12
+            piece = self.remove_piece(end)
+            if flags & PROMOTION:
+                piece = (piece >= 6) * 6 + PAWN
+            self.put_piece(piece, start)
+            if captured != EMPTY:
+                self.put_piece(captured, end)
+            if flags == EN_PASSANT:
+                self.put_piece((piece < 6) * 6 + PAWN, (start & 56) | (end & 7))
+            elif flags == KING_CASTLE or flags == QUEEN_CASTLE:
+                rook_start, rook_end = CASTLING_ROOK[end]
+                self.put_piece(self.remove_piece(rook_end), rook_start)
+            if piece >= 6:
+                self.fullmove_number -= 1
+            self.zobrist = zobrist
             self.white_to_move  = not self.white_to_move #switch turn
 
     def get_valid_moves(self):
-        moves = []
-        self.in_check, self.pins, self.checks = self.find_pinsAndChecks()
-        if self.white_to_move:
-            king_row = self.whiteKing_loc[0]
-            king_col = self.whiteKing_loc[1]
+        '''All legal moves as Move objects, for the UI.'''
+        return [Move.from_code(code, self) for code in self.get_valid_move_codes()]
+
+    def get_valid_move_codes(self, moves=None, kind=GEN_ALL):
+        '''
+        All legal moves as packed int codes, or only the noisy or quiet ones (GEN_NOISY, GEN_QUIET).
+        If a list is given it is cleared and reused as the output buffer.
+        '''
+        if moves is None:
+            moves = []
         else:
-            king_row = self.blackKing_loc[0]
-            king_col = self.blackKing_loc[1]
-        if self.in_check:
-            if len(self.checks) == 1: # Only one piece is checking -> block or move the king
-                moves = self.get_possible_moves()
-                #block
-                check = self.checks[0]
-                check_row = check[0]
-                check_col = check[1]
-                piece_checking = self.board[check_row][check_col]
-                valid_sq = []
-                if piece_checking[1] == 'N':
-                    valid_sq = [check_row][check_col]
-                else:
-                    for i in range(1,8): 
-                        a = (king_row + check[2]*i, king_col + check[3]*i) 
-                        valid_sq.append(a)
-                        if a[0] == check_row and a[1] == check_col:
-                            break
-                for i in range(len(moves)-1, -1, -1):
-                    if moves[i].piece_moved[1] != 'K':
-                        if not (moves[i].end_row, moves[i].end_col) in valid_sq:
-                            moves.remove(moves[i])
+            moves.clear()
+        if kind != GEN_ALL:
+            self.ensure_attack_masks()
+            checkers = self.checkers
+            if checkers & (checkers - 1):
+                self.get_king_moves(self.king_sq[WHITE if self.white_to_move else BLACK], moves, kind)
             else:
-                self.get_king_moves(king_row, king_col, moves)
+                self.get_possible_moves(moves, kind)
+            return moves
+        cache = self.move_cache
+        if cache is not None:
+            entry = cache.get(self.zobrist)
+            if entry is not None:
+                codes, self.in_check, self.checkers = entry
+                moves.extend(codes)
+                return moves
+        self.find_pinsAndChecks()
+        checkers = self.checkers
+        if checkers & (checkers - 1):  # double check, only the king can move
+            self.get_king_moves(self.king_sq[WHITE if self.white_to_move else BLACK], moves)
         else:
-            moves = self.get_possible_moves()
+            # the check and pin masks already keep every generated move legal
+            self.get_possible_moves(moves)
+        if cache is not None:
+            cache.put(self.zobrist, (tuple(moves), self.in_check, checkers))
         return moves
 
     def find_pinsAndChecks(self):
-        pins = []  # squares pinned and the direction its pinned from
-        checks = []  # squares where enemy is applying a check
-        in_check = False
+        '''
+        Set the check, pin and attack masks of the side to move (see __init__), so that
+        is_attacked, is_pinned and checkers are plain bit tests for the rest of the position.
+        '''
         if self.white_to_move:
-            enemy_color = "b"
-            ally_color = "w"
-            start_row = self.whiteKing_loc[0]
-            start_col = self.whiteKing_loc[1]
+            ally = WHITE
+            enemy = BLACK
         else:
-            enemy_color = "w"
-            ally_color = "b"
-            start_row = self.blackKing_loc[0]
-            start_col = self.blackKing_loc[1]
-        # check outwards from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            direction = directions[j]
-            possible_pin = ()  # reset possible pins
-            for i in range(1, 8):
-                end_row = start_row + direction[0] * i
-                end_col = start_col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == ally_color and end_piece[1] != "K":
-                        if possible_pin == ():  # first allied piece could be pinned
-                            possible_pin = (end_row, end_col, direction[0], direction[1])
-                        else:  # 2nd allied piece - no check or pin from this direction
-                            break
-                    elif end_piece[0] == enemy_color:
-                        enemy_type = end_piece[1]
-                        # 5 possibilities in this complex conditional
-                        # 1.) orthogonally away from king and piece is a rook
-                        # 2.) diagonally away from king and piece is a bishop
-                        # 3.) 1 square away diagonally from king and piece is a pawn
-                        # 4.) any direction and piece is a queen
-                        # 5.) any direction 1 square away and piece is a king
-                        if (0 <= j <= 3 and enemy_type == "R") or \
-                            (4 <= j <= 7 and enemy_type == "B") or \
-                            (i == 1 and enemy_type == "p" and 
-                            ((enemy_color == "w" and 6 <= j <= 7) or \
-                            (enemy_color == "b" and 4 <= j <= 5))) or \
-                            (enemy_type == "Q") or \
-                            (i == 1 and enemy_type == "K"):
-                            if possible_pin == ():  # no piece blocking, so check
-                                in_check = True
-                                checks.append((end_row, end_col, direction[0], direction[1]))
-                                break
-                            else:  # piece blocking so pin
-                                pins.append(possible_pin)
-                                break
-                        else:  # enemy piece not applying checks
-                            break
-                else:
-                    break  # off board
-        # check for knight checks
-        knight_moves = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
-        for move in knight_moves:
-            end_row = start_row + move[0]
-            end_col = start_col + move[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == enemy_color and end_piece[1] == "N":  # enemy knight attacking a king
-                    in_check = True
-                    checks.append((end_row, end_col, move[0], move[1]))
-        return in_check, pins, checks
+            ally = BLACK
+            enemy = WHITE
+        king_sq = self.king_sq[ally]
+        occupied = self.occupied
+        ally_bb = self.colors[ally]
+        pieces = self.pieces
+        base = enemy*6
+        queens = pieces[base + QUEEN]
+        orthogonal_sliders = pieces[base + ROOK] | queens
+        diagonal_sliders = pieces[base + BISHOP] | queens
+        # pawn and knight checks come straight from the attack tables
+        checkers = (PAWN_ATTACKS[ally][king_sq] & pieces[base + PAWN]) | (KNIGHT_ATTACKS[king_sq] & pieces[base + KNIGHT])
+        check_mask = checkers
+        pinned = 0
+        pin_lines = {}
+        # look along each ray from the king for the nearest piece, and for the one behind it
+        for j in range(8):
+            ray = RAYS[j][king_sq]
+            blockers = ray & occupied
+            if not blockers:
+                continue
+            sliders = orthogonal_sliders if j < 4 else diagonal_sliders
+            if not ray & sliders:
+                continue
+            positive = POSITIVE[j]
+            first = lsb(blockers) if positive else msb(blockers)
+            if ally_bb & SQUARE_BB[first]:  # first allied piece could be pinned
+                behind = RAYS[j][first] & occupied
+                if behind:
+                    second = lsb(behind) if positive else msb(behind)
+                    if sliders & SQUARE_BB[second]:
+                        pinned |= SQUARE_BB[first]
+                        pin_lines[first] = ray & ~RAYS[j][second]
+            elif sliders & SQUARE_BB[first]:  # no piece blocking, so check
+                checkers |= SQUARE_BB[first]
+                check_mask |= ray & ~RAYS[j][first]
+        self.in_check = bool(checkers)
+        self.checkers = checkers
+        self.check_mask = FULL if not checkers else check_mask if not checkers & (checkers - 1) else 0
+        self.pinned = pinned
+        self.pin_lines = pin_lines
+        self.attacked = self.attack_map(enemy, occupied ^ SQUARE_BB[king_sq])
+        self.attack_key = self.zobrist
+        self.gen_targets = (~ally_bb, self.colors[enemy], ~occupied)
+
+    def attack_map(self, color, occupied=None):
+        '''Every square a piece of color attacks, with sliders blocked by occupied.'''
+        if occupied is None:
+            occupied = self.occupied
+        pieces = self.pieces
+        base = color*6
+        attacks = pawn_attacks(pieces[base + PAWN], color)
+        for sq in iter_squares(pieces[base + KNIGHT]):
+            attacks |= KNIGHT_ATTACKS[sq]
+        queens = pieces[base + QUEEN]
+        for sq in iter_squares(pieces[base + BISHOP] | queens):
+            attacks |= bishop_attacks(sq, occupied)
+        for sq in iter_squares(pieces[base + ROOK] | queens):
+            attacks |= rook_attacks(sq, occupied)
+        king_sq = self.king_sq[color]
+        if king_sq != NO_SQUARE:
+            attacks |= KING_ATTACKS[king_sq]
+        return attacks
+
+    def ensure_attack_masks(self):
+        if self.attack_key != self.zobrist:
+            self.find_pinsAndChecks()
+
+    def is_attacked(self, sq):
+        '''True if the side not to move attacks sq. O(1) once the masks of the position are set.'''
+        self.ensure_attack_masks()
+        return bool(self.attacked & SQUARE_BB[sq])
+
+    def is_pinned(self, sq):
+        '''True if the piece on sq is pinned to the king of the side to move.'''
+        self.ensure_attack_masks()
+        return bool(self.pinned & SQUARE_BB[sq])
+
+    def get_checkers(self):
+        '''Bitboard of the pieces giving check to the side to move.'''
+        self.ensure_attack_masks()
+        return self.checkers
+
+    def is_square_attacked(self, sq, by_color, occupied=None):
+        '''
+        True if any piece of by_color attacks sq, looked up from scratch.
+        occupied overrides the occupancy used for sliders, e.g. with the moving king taken off.
+        '''
+        if occupied is None:
+            occupied = self.occupied
+        pieces = self.pieces
+        base = by_color*6
+        if KNIGHT_ATTACKS[sq] & pieces[base + KNIGHT]:
+            return True
+        if PAWN_ATTACKS[by_color ^ 1][sq] & pieces[base + PAWN]:
+            return True
+        if KING_ATTACKS[sq] & pieces[base + KING]:
+            return True
+        queens = pieces[base + QUEEN]
+        if rook_attacks(sq, occupied) & (pieces[base + ROOK] | queens):
+            return True
+        return bool(bishop_attacks(sq, occupied) & (pieces[base + BISHOP] | queens))
+
+    def is_legal(self, move):
+        '''
+        True if the move code is legal here, e.g. a hash or killer move taken from another
+        position. Only the moves of the piece on its start square are generated.
+        '''
+        self.ensure_attack_masks()
+        start = move & 63
+        piece = self.mailbox[start]
+        if piece == EMPTY or (piece < 6) != self.white_to_move:
+            return False
+        checkers = self.checkers
+        if checkers & (checkers - 1) and piece % 6 != KING:
+            return False
+        moves = []
+        self.move_functions[PIECE_LETTERS[piece % 6]](start, moves)
+        return move in moves
+
+    def allowed_targets(self, sq):
+        '''Squares a non-king piece on sq may move to as far as checks and pins go.'''
+        if self.pinned & SQUARE_BB[sq]:
+            return self.check_mask & self.pin_lines[sq]
+        return self.check_mask
+
+    def add_moves(self, sq, targets, moves):
+        '''Append a move from sq to every target square, flagging captures.'''
+        enemy_bb = self.colors[BLACK if self.white_to_move else WHITE]
+        append = moves.append
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            if enemy_bb & bit:
+                append(sq | (bit.bit_length() - 1) << 6 | CAPTURE << 12)
+            else:
+                append(sq | (bit.bit_length() - 1) << 6)
 
     '''Get pawn moves'''
-    def get_pawn_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
+    def get_pawn_moves(self, sq, moves, kind=GEN_ALL):
+        allowed = self.allowed_targets(sq)
         if self.white_to_move:
-            if self.board[r-1][c] == '--': #pawn advance
-                if not piece_pinned or pin_direction == (-1,0) or pin_direction == (1,0):
-                    moves.append(Move((r,c), (r-1, c), self.board))
-                    if r == 6 and self.board[r-2][c] == '--':
-                        moves.append(Move((r,c), (r-2, c), self.board))
-            if c-1 >= 0: #capture to the left
-                if not piece_pinned or pin_direction in ((-1,-1), (1,1), (1,-1), (-1,1)):                
-                    if self.board[r-1][c-1][0] == 'b': #enemy piece to capture
-                        moves.append(Move((r,c), (r-1, c-1), self.board))
-            if c+1 <= 7: #capture to the right
-                if self.board[r-1][c+1][0] == 'b':
-                    if not piece_pinned or pin_direction in ((-1,-1), (1,1), (1,-1), (-1,1)): 
-                        moves.append(Move((r,c), (r-1, c+1), self.board))
-
+            ally, enemy, step, start_row, last_row = WHITE, BLACK, -8, 6, 0
         else:
-            if self.board[r+1][c] == '--': #pawn advance
-                if not piece_pinned or pin_direction == (1,0): 
-                    moves.append(Move((r,c), (r+1, c), self.board))
-                    if r == 1 and self.board[r+2][c] == '--':
-                        moves.append(Move((r,c), (r+2, c), self.board))
-            if c-1 >= 0: #capture to the left
-                if not piece_pinned or pin_direction in ((-1,-1), (1,1), (1,-1), (-1,1)): 
-                    if self.board[r+1][c-1][0] == 'w': #enemy piece to capture
-                        moves.append(Move((r,c), (r+1, c-1), self.board))
-            if c+1 <= 7: #capture to the right
-                if not piece_pinned or pin_direction in ((-1,-1), (1,1), (1,-1), (-1,1)): 
-                    if self.board[r+1][c+1][0] == 'w': 
-                        moves.append(Move((r,c), (r+1, c+1), self.board))            
+            ally, enemy, step, start_row, last_row = BLACK, WHITE, 8, 1, 7
+        occupied = self.occupied
+        if not occupied & SQUARE_BB[sq + step]:  # pawn advance
+            if (sq + step) >> 3 == last_row:  # promotions count as noisy
+                if kind != GEN_QUIET and allowed & SQUARE_BB[sq + step]:
+                    self.add_promotions(sq, sq + step, 0, moves)
+            elif kind != GEN_NOISY:
+                if allowed & SQUARE_BB[sq + step]:
+                    moves.append(sq | (sq + step) << 6)
+                if sq >> 3 == start_row and not occupied & SQUARE_BB[sq + 2*step] and allowed & SQUARE_BB[sq + 2*step]:
+                    moves.append(sq | (sq + 2*step) << 6 | DOUBLE_PUSH << 12)
+        if kind == GEN_QUIET:
+            return
+        for end in iter_squares(PAWN_ATTACKS[ally][sq] & self.colors[enemy] & allowed):
+            if end >> 3 == last_row:
+                self.add_promotions(sq, end, CAPTURE, moves)
+            else:
+                moves.append(sq | end << 6 | CAPTURE << 12)
+        ep = self.ep_square
+        # en passant is checked in full, the captured pawn may be the checker or shield a slider
+        if ep != NO_SQUARE and PAWN_ATTACKS[ally][sq] & SQUARE_BB[ep] and self.en_passant_is_legal(sq, ep):
+            moves.append(sq | ep << 6 | EN_PASSANT << 12)
+
+    def en_passant_is_legal(self, start, ep):
+        '''
+        En passant takes two pawns off one rank at once, which the pin scan cannot see,
+        so check the king directly against the position after the capture.
+        '''
+        ally = WHITE if self.white_to_move else BLACK
+        enemy = ally ^ 1
+        captured_sq = (start & 56) | (ep & 7)
+        occupied = (self.occupied ^ SQUARE_BB[start] ^ SQUARE_BB[captured_sq]) | SQUARE_BB[ep]
+        king_sq = self.king_sq[ally]
+        pieces = self.pieces
+        queens = pieces[enemy*6 + QUEEN]
+        if rook_attacks(king_sq, occupied) & (pieces[enemy*6 + ROOK] | queens):
+            return False
+        if bishop_attacks(king_sq, occupied) & (pieces[enemy*6 + BISHOP] | queens):
+            return False
+        if KNIGHT_ATTACKS[king_sq] & pieces[enemy*6 + KNIGHT]:
+            return False
+        return not PAWN_ATTACKS[ally][king_sq] & pieces[enemy*6 + PAWN] & ~SQUARE_BB[captured_sq]
+
+    def add_promotions(self, start, end, flags, moves):
+        '''Queen first, so a UI that takes the first matching move promotes to a queen.'''
+        for promotion in (PROMOTE_QUEEN, PROMOTE_ROOK, PROMOTE_BISHOP, PROMOTE_KNIGHT):
+            moves.append(start | end << 6 | (flags | promotion) << 12)
+
+    def get_slider_targets(self, sq, attacks, kind):
+        targets = attacks & self.gen_targets[kind]
+        if self.pinned & SQUARE_BB[sq]:  # only slide along the pin
+            targets &= self.pin_lines[sq]
+        return targets & self.check_mask
 
     '''Get rook moves'''
-    def get_rook_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        directions = ((-1,0), (0,-1), (1,0), (0,1))
-        enemy_color = 'b' if self.white_to_move else 'w'
-        for d in directions:
-            for i in range(1,8):
-                end_row = r + d[0]*i
-                end_col = c + d[1]*i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece == '--':
-                        moves.append(Move((r,c), (end_row, end_col), self.board))
-                    elif end_piece[0] == enemy_color:
-                        moves.append(Move((r,c), (end_row, end_col), self.board))
-                        break
-                    else:
-                        break
-                else:
-                    break
+    def get_rook_moves(self, sq, moves, kind=GEN_ALL):
+        self.add_moves(sq, self.get_slider_targets(sq, rook_attacks(sq, self.occupied), kind), moves)
 
     '''Get bishop moves'''
-    def get_bishop_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        directions = ((-1, -1), (-1, 1), (1, 1), (1, -1))  # diagonals: up/left up/right down/right down/left
-        enemy_color = "b" if self.white_to_move else "w"
-        for direction in directions:
-            for i in range(1, 8):
-                end_row = r + direction[0] * i
-                end_col = c + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:  # check if the move is on board
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece == "--":  # empty space is valid
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    elif end_piece[0] == enemy_color:  # capture enemy piece
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                        break
-                    else:  # friendly piece
-                        break
-                else:  # off board
-                    break
+    def get_bishop_moves(self, sq, moves, kind=GEN_ALL):
+        self.add_moves(sq, self.get_slider_targets(sq, bishop_attacks(sq, self.occupied), kind), moves)
 
     '''Get knight moves'''
-    def get_knight_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        knight_moves = ((-2,1), (2,1), (-2,-1), (2,-1), (1,2), (-1,-2), (1,-2), (-1,2))
-        ally_color = 'w' if self.white_to_move else 'b'
-        for d in knight_moves:
-            end_row = r + d[0]
-            end_col = c + d[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    moves.append(Move((r,c), (end_row, end_col), self.board))
+    def get_knight_moves(self, sq, moves, kind=GEN_ALL):
+        if self.pinned & SQUARE_BB[sq]:  # a pinned knight can never move
+            return
+        self.add_moves(sq, KNIGHT_ATTACKS[sq] & self.gen_targets[kind] & self.check_mask, moves)
     
     '''Get king moves'''
-    def get_king_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        king_moves = ((-1,0),  (0,1), (1,0), (0,-1), (1,1), (-1,1), (-1,-1), (1,-1))
-        allY_color = 'w' if self.white_to_move else 'b'
-        for i in range(8):
-            end_row = r + king_moves[i][0]
-            end_col = c + king_moves[i][1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != allY_color:
-                    moves.append(Move((r,c), (end_row, end_col), self.board))
+    def get_king_moves(self, sq, moves, kind=GEN_ALL):
+        # self.attacked looks through the king, so it cannot step back along a checking line
+        self.add_moves(sq, KING_ATTACKS[sq] & self.gen_targets[kind] & ~self.attacked, moves)
+        if self.castling_rights and not self.in_check and kind != GEN_NOISY:
+            self.get_castle_moves(sq, WHITE if self.white_to_move else BLACK, moves)
+
+    def get_castle_moves(self, sq, ally, moves):
+        '''The king may not pass through or land on an attacked square.'''
+        rights = self.castling_rights
+        occupied = self.occupied
+        attacked = self.attacked
+        if ally == WHITE:
+            kingside, queenside = rights & WHITE_KINGSIDE, rights & WHITE_QUEENSIDE
+        else:
+            kingside, queenside = rights & BLACK_KINGSIDE, rights & BLACK_QUEENSIDE
+        if kingside and not occupied & (SQUARE_BB[sq + 1] | SQUARE_BB[sq + 2]):
+            if not attacked & (SQUARE_BB[sq + 1] | SQUARE_BB[sq + 2]):
+                moves.append(sq | (sq + 2) << 6 | KING_CASTLE << 12)
+        if queenside and not occupied & (SQUARE_BB[sq - 1] | SQUARE_BB[sq - 2] | SQUARE_BB[sq - 3]):
+            if not attacked & (SQUARE_BB[sq - 1] | SQUARE_BB[sq - 2]):
+                moves.append(sq | (sq - 2) << 6 | QUEEN_CASTLE << 12)
 
     '''Get queen moves'''
-    def get_queen_moves(self, r, c, moves):
-        self.get_bishop_moves(r, c, moves)
-        self.get_rook_moves(r, c, moves)
+    def get_queen_moves(self, sq, moves, kind=GEN_ALL):
+        occupied = self.occupied
+        self.add_moves(sq, self.get_slider_targets(sq, rook_attacks(sq, occupied) | bishop_attacks(sq, occupied),
+                                                   kind), moves)
         
+
+def square_index(name):
+    '''Square number of an algebraic square name like "e4".'''
+    return Move.ranks_to_rows[name[1]]*8 + Move.files_to_cols[name[0]]
+
+
+def square_name(sq):
+    return Move.cols_to_files[sq & 7] + Move.rows_to_ranks[sq >> 3]
+
+
+def parse_epd_operations(text):
+    '''Split the operations part of an EPD line into a dict of opcode -> operand string.'''
+    operations = {}
+    if '"' not in text:
+        for operation in text.split(';'):
+            operation = operation.strip()
+            if operation:
+                opcode, _, operand = operation.partition(' ')
+                operations[opcode] = operand.strip()
+        return operations
+    # quoted operands may contain ';', so only split the unquoted parts (the even pieces)
+    operation = ''
+    for i, part in enumerate(text.split('"')):
+        if i % 2:
+            operation += part
+            continue
+        pieces = part.split(';')
+        operation += pieces[0]
+        for piece in pieces[1:]:
+            operation = operation.strip()
+            if operation:
+                opcode, _, operand = operation.partition(' ')
+                operations[opcode] = operand.strip()
+            operation = piece
+    operation = operation.strip()
+    if operation:
+        opcode, _, operand = operation.partition(' ')
+        operations[opcode] = operand.strip()
+    return operations
+
+
 class Move():
+    '''
+    UI-facing wrapper around a packed move code.
+    The engine itself passes moves around as ints:
+        bits 0-5 start square, bits 6-11 end square, bits 12-15 flags (QUIET, CAPTURE, PROMOTION, ...)
+    with squares numbered row*8 + col.
+    '''
+    __slots__ = ('code', 'piece_moved', 'piece_captured')
+
     #maps key to values
     #key: value 
     ranks_to_rows = {'1':7, '2':6, '3':5, '4':4, 
@@ -321,15 +927,50 @@ class Move():
                     'e': 4,'f':5, 'g': 6, 'h':7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
-    def __init__(self, start_sq, end_sq, board):
-        self.start_row = start_sq[0]
-        self.start_col = start_sq[1]
-        self.end_row = end_sq[0]
-        self.end_col = end_sq[1]
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
-        self.moveID = self.start_row*1000 + self.start_col*100 + self.end_row*10 + self.end_col
-        print(self.moveID)
+    def __init__(self, start_sq, end_sq, board, flags=QUIET):
+        self.code = start_sq[0]*8 + start_sq[1] | (end_sq[0]*8 + end_sq[1]) << 6 | flags << 12
+        self.piece_moved = board[start_sq[0]][start_sq[1]]
+        self.piece_captured = board[end_sq[0]][end_sq[1]]
+
+    @classmethod
+    def from_code(cls, code, gs):
+        '''Wrap a move code generated for the position in gs.'''
+        move = cls.__new__(cls)
+        move.code = code
+        mailbox = gs.mailbox
+        piece = mailbox[code & 63]
+        captured = mailbox[(code >> 6) & 63]
+        move.piece_moved = PIECE_NAMES[piece] if piece != EMPTY else "--"
+        move.piece_captured = PIECE_NAMES[captured] if captured != EMPTY else "--"
+        return move
+
+    @property
+    def start_row(self):
+        return (self.code & 63) >> 3
+
+    @property
+    def start_col(self):
+        return self.code & 7
+
+    @property
+    def end_row(self):
+        return (self.code >> 9) & 7
+
+    @property
+    def end_col(self):
+        return (self.code >> 6) & 7
+
+    @property
+    def flags(self):
+        return self.code >> 12
+
+    @property
+    def moveID(self):
+        return self.start_row*1000 + self.start_col*100 + self.end_row*10 + self.end_col
+
+    @property
+    def is_pawn_promotion(self):
+        return bool(self.flags & PROMOTION)
 
     def __eq__(self, other):
         if isinstance(other, Move):
@@ -337,28 +978,10 @@ class Move():
         return False
 
     def get_chess_notation(self):
-        return self.get_rank_file(self.start_row, self.start_col) + "-" + self.get_rank_file(self.end_row, self.end_col)
+        notation = self.get_rank_file(self.start_row, self.start_col) + "-" + self.get_rank_file(self.end_row, self.end_col)
+        if self.is_pawn_promotion:
+            notation += PIECE_LETTERS[PROMOTION_PIECES[self.flags & 3]]
+        return notation
 
     def get_rank_file(self, r, c):
         return self.cols_to_files[c] + self.rows_to_ranks[r]
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,241 @@
+'''
+Static evaluation: material, tapered piece-square tables, mobility and king safety.
+
+Material and piece-square scores are kept up to date by GameState.put_piece/remove_piece
+(so by make_move/undo_move) in GameState.mg_score, eg_score and phase; evaluating a leaf only
+blends them by game phase. Mobility and king safety need attack sets and are computed per call.
+
+Weights are plain data and can be swapped for tuned ones:
+
+    weights = EvalWeights.load("tuned.json")
+    result = ChessSearch.find_best_move(gs, time_ms=500, evaluator=Evaluator(weights))
+
+The JSON file holds any subset of EvalWeights.FIELDS; missing fields keep their defaults.
+'''
+
+import json
+
+from ChessBitboard import (WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, iter_squares, popcount,
+                           KNIGHT_ATTACKS, KING_ATTACKS, rook_attacks, bishop_attacks, queen_attacks, pawn_attacks)
+
+PHASE_WEIGHTS = (0, 1, 1, 2, 4, 0)  # per piece type, 24 with all pieces on the board
+MAX_PHASE = 24
+PIECE_PHASE = PHASE_WEIGHTS * 2  # per piece index
+
+# Piece-square tables from white's view with rank 8 first, so index row*8 + col matches the
+# square numbering. Black pieces use the table mirrored vertically (sq ^ 56).
+MG_TABLES = (
+    (0, 0, 0, 0, 0, 0, 0, 0,
+     50, 50, 50, 50, 50, 50, 50, 50,
+     10, 10, 20, 30, 30, 20, 10, 10,
+     5, 5, 10, 25, 25, 10, 5, 5,
+     0, 0, 0, 20, 20, 0, 0, 0,
+     5, -5, -10, 0, 0, -10, -5, 5,
+     5, 10, 10, -20, -20, 10, 10, 5,
+     0, 0, 0, 0, 0, 0, 0, 0),
+    (-50, -40, -30, -30, -30, -30, -40, -50,
+     -40, -20, 0, 0, 0, 0, -20, -40,
+     -30, 0, 10, 15, 15, 10, 0, -30,
+     -30, 5, 15, 20, 20, 15, 5, -30,
+     -30, 0, 15, 20, 20, 15, 0, -30,
+     -30, 5, 10, 15, 15, 10, 5, -30,
+     -40, -20, 0, 5, 5, 0, -20, -40,
+     -50, -40, -30, -30, -30, -30, -40, -50),
+    (-20, -10, -10, -10, -10, -10, -10, -20,
+     -10, 0, 0, 0, 0, 0, 0, -10,
+     -10, 0, 5, 10, 10, 5, 0, -10,
+     -10, 5, 5, 10, 10, 5, 5, -10,
+     -10, 0, 10, 10, 10, 10, 0, -10,
+     -10, 10, 10, 10, 10, 10, 10, -10,
+     -10, 5, 0, 0, 0, 0, 5, -10,
+     -20, -10, -10, -10, -10, -10, -10, -20),
+    (0, 0, 0, 0, 0, 0, 0, 0,
+     5, 10, 10, 10, 10, 10, 10, 5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     0, 0, 0, 5, 5, 0, 0, 0),
+    (-20, -10, -10, -5, -5, -10, -10, -20,
+     -10, 0, 0, 0, 0, 0, 0, -10,
+     -10, 0, 5, 5, 5, 5, 0, -10,
+     -5, 0, 5, 5, 5, 5, 0, -5,
+     0, 0, 5, 5, 5, 5, 0, -5,
+     -10, 5, 5, 5, 5, 5, 0, -10,
+     -10, 0, 5, 0, 0, 0, 0, -10,
+     -20, -10, -10, -5, -5, -10, -10, -20),
+    (-30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -20, -30, -30, -40, -40, -30, -30, -20,
+     -10, -20, -20, -20, -20, -20, -20, -10,
+     20, 20, 0, 0, 0, 0, 20, 20,
+     20, 30, 10, 0, 0, 10, 30, 20),
+)
+
+# in the endgame passers matter more, rooks and queens are free to roam and the king centralizes
+EG_TABLES = (
+    (0, 0, 0, 0, 0, 0, 0, 0,
+     80, 80, 80, 80, 80, 80, 80, 80,
+     50, 50, 50, 50, 50, 50, 50, 50,
+     30, 30, 30, 30, 30, 30, 30, 30,
+     15, 15, 15, 15, 15, 15, 15, 15,
+     5, 5, 5, 5, 5, 5, 5, 5,
+     0, 0, 0, 0, 0, 0, 0, 0,
+     0, 0, 0, 0, 0, 0, 0, 0),
+    MG_TABLES[KNIGHT],
+    MG_TABLES[BISHOP],
+    (0,) * 64,
+    (-10, -5, -5, -5, -5, -5, -5, -10,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -5, 0, 5, 5, 5, 5, 0, -5,
+     -5, 0, 5, 10, 10, 5, 0, -5,
+     -5, 0, 5, 10, 10, 5, 0, -5,
+     -5, 0, 5, 5, 5, 5, 0, -5,
+     -5, 0, 0, 0, 0, 0, 0, -5,
+     -10, -5, -5, -5, -5, -5, -5, -10),
+    (-50, -40, -30, -20, -20, -30, -40, -50,
+     -30, -20, -10, 0, 0, -10, -20, -30,
+     -30, -10, 20, 30, 30, 20, -10, -30,
+     -30, -10, 30, 40, 40, 30, -10, -30,
+     -30, -10, 30, 40, 40, 30, -10, -30,
+     -30, -10, 20, 30, 30, 20, -10, -30,
+     -30, -30, 0, 0, 0, 0, -30, -30,
+     -50, -30, -30, -30, -30, -30, -30, -50),
+)
+
+
+def _shield_masks():
+    '''[color][king sq] squares one and two rows in front of the king, on its file and both neighbours.'''
+    masks = [[0] * 64, [0] * 64]
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        for color, step in ((WHITE, -1), (BLACK, 1)):
+            mask = 0
+            for ahead in (1, 2):
+                r = row + step*ahead
+                for c in (col - 1, col, col + 1):
+                    if 0 <= r < 8 and 0 <= c < 8:
+                        mask |= 1 << (r*8 + c)
+            masks[color][sq] = mask
+    return masks
+
+
+SHIELD_MASKS = _shield_masks()
+
+
+class EvalWeights():
+    '''All tunable numbers of the evaluation, in centipawns.'''
+    FIELDS = ("mg_values", "eg_values", "mg_tables", "eg_tables", "mg_mobility", "eg_mobility",
+              "king_shield", "king_attack")
+
+    def __init__(self, **fields):
+        self.mg_values = (100, 320, 330, 500, 900, 0)
+        self.eg_values = (120, 300, 320, 520, 950, 0)
+        self.mg_tables = MG_TABLES
+        self.eg_tables = EG_TABLES
+        self.mg_mobility = (0, 4, 4, 2, 1, 0)  # per safe square a piece of each type attacks
+        self.eg_mobility = (0, 4, 5, 4, 2, 0)
+        self.king_shield = 10  # per own pawn in front of the king, middlegame only
+        self.king_attack = (0, 8, 8, 10, 15, 0)  # per square of the enemy king zone attacked, middlegame only
+        for name, value in fields.items():
+            if name not in self.FIELDS:
+                raise ValueError("unknown evaluation weight: " + name)
+            setattr(self, name, value)
+        self.mg_piece_square, self.eg_piece_square = self.piece_square_tables()
+
+    def piece_square_tables(self):
+        '''
+        (mg, eg) lists [piece index][sq] of material plus piece-square score,
+        positive for white and negative for black, as GameState adds them up.
+        '''
+        tables = []
+        for values, psts in ((self.mg_values, self.mg_tables), (self.eg_values, self.eg_tables)):
+            table = [None] * 12
+            for piece_type in range(6):
+                pst = psts[piece_type]
+                table[WHITE*6 + piece_type] = [values[piece_type] + pst[sq] for sq in range(64)]
+                table[BLACK*6 + piece_type] = [-(values[piece_type] + pst[sq ^ 56]) for sq in range(64)]
+            tables.append(table)
+        return tables
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: tuple(tuple(v) if isinstance(v, list) else v for v in value)
+                      if isinstance(value, list) else value
+                      for name, value in data.items()})
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+
+DEFAULT_WEIGHTS = EvalWeights()
+
+
+class Evaluator():
+    '''
+    Callable evaluation, score(gs) in centipawns from the side to move's point of view.
+    A GameState built with other weights is switched to this evaluator's weights on first use.
+    '''
+    def __init__(self, weights=None):
+        self.weights = weights if weights is not None else DEFAULT_WEIGHTS
+
+    def __call__(self, gs):
+        mg, eg = self.terms(gs)
+        if not gs.white_to_move:  # before dividing, so mirrored positions round the same way
+            mg = -mg
+            eg = -eg
+        phase = min(gs.phase, MAX_PHASE)
+        return (mg*phase + eg*(MAX_PHASE - phase)) // MAX_PHASE
+
+    def terms(self, gs):
+        '''(middlegame, endgame) scores from white's point of view, before tapering.'''
+        weights = self.weights
+        if gs.eval_weights is not weights:
+            gs.set_eval_weights(weights)
+        mg = gs.mg_score
+        eg = gs.eg_score
+        pieces = gs.pieces
+        occupied = gs.occupied
+        mg_mobility = weights.mg_mobility
+        eg_mobility = weights.eg_mobility
+        king_attack = weights.king_attack
+        pawn_cover = (pawn_attacks(pieces[WHITE*6 + PAWN], WHITE), pawn_attacks(pieces[BLACK*6 + PAWN], BLACK))
+        for color in (WHITE, BLACK):
+            sign = 1 if color == WHITE else -1
+            safe = ~gs.colors[color] & ~pawn_cover[color ^ 1]
+            enemy_king = gs.king_sq[color ^ 1]
+            zone = KING_ATTACKS[enemy_king] if enemy_king >= 0 else 0
+            base = color * 6
+            for piece_type, attacks_of in ((KNIGHT, None), (BISHOP, bishop_attacks),
+                                           (ROOK, rook_attacks), (QUEEN, queen_attacks)):
+                for sq in iter_squares(pieces[base + piece_type]):
+                    attacks = KNIGHT_ATTACKS[sq] if attacks_of is None else attacks_of(sq, occupied)
+                    count = popcount(attacks & safe)
+                    mg += sign * mg_mobility[piece_type] * count
+                    eg += sign * eg_mobility[piece_type] * count
+                    if attacks & zone:
+                        mg += sign * king_attack[piece_type] * popcount(attacks & zone)
+            king = gs.king_sq[color]
+            if king >= 0:
+                mg += sign * weights.king_shield * popcount(SHIELD_MASKS[color][king] & pieces[base + PAWN])
+        return mg, eg
+
+
+DEFAULT_EVALUATOR = Evaluator()
+
+
+def evaluate(gs):
+    '''Score of gs with the default weights, from the side to move's point of view.'''
+    return DEFAULT_EVALUATOR(gs)
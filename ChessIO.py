@@ -0,0 +1,329 @@
+'''
+Reading and writing positions and games: EPD/FEN files, SAN and PGN.
+
+    for gs, operations in iter_epd("suite.epd"):
+        ...
+    for headers, gs, move in replay_pgn("games.pgn"):
+        ...
+    text = to_pgn(gs, {"White": "me"})
+
+Files are read lazily line by line and one GameState is reused for every position, so memory
+use does not depend on the file size. The yielded GameState is overwritten by the next
+position: copy() it to keep it.
+'''
+
+import re
+
+import ChessEngine
+from ChessBitboard import PAWN, QUEEN, PIECE_LETTERS
+
+
+def _open_lines(source):
+    '''Lines of a path or of an already open text file.'''
+    if isinstance(source, str):
+        with open(source, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                yield line
+    else:
+        for line in source:
+            yield line
+
+
+def iter_epd(source, gs=None, skip_errors=False):
+    '''
+    Yield (gs, operations) for every EPD (or FEN) line of source, a path or open text file.
+    Blank lines and lines starting with '#' are skipped. Malformed lines raise ValueError
+    unless skip_errors is set.
+    '''
+    if gs is None:
+        gs = ChessEngine.GameState()
+    for line in _open_lines(source):
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        try:
+            operations = gs.load_epd(line)
+        except (ValueError, KeyError, IndexError):
+            if skip_errors:
+                continue
+            raise ValueError("bad EPD line: " + line)
+        yield gs, operations
+
+
+def iter_fen(source, gs=None, skip_errors=False):
+    '''Yield gs set up from every FEN line of source, reusing one GameState.'''
+    if gs is None:
+        gs = ChessEngine.GameState()
+    for line in _open_lines(source):
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        try:
+            gs.load_fen(line)
+        except (ValueError, KeyError, IndexError):
+            if skip_errors:
+                continue
+            raise ValueError("bad FEN line: " + line)
+        yield gs
+
+
+# ---------------------------------------------------------------------------
+# SAN and PGN
+# ---------------------------------------------------------------------------
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SEVEN_TAG_ROSTER = (("Event", "?"), ("Site", "?"), ("Date", "????.??.??"), ("Round", "?"),
+                    ("White", "?"), ("Black", "?"), ("Result", "*"))
+
+_TAG_RE = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+_TOKEN_RE = re.compile(r'[{}();]|[^\s{}();]+')
+_MOVE_NUMBER_RE = re.compile(r'^\d+\.+')  # the dots are required, or castling written 0-0 would lose its 0
+
+
+def move_to_san(gs, move, legal_moves=None):
+    '''
+    SAN of move (a code) in the current position of gs, e.g. "Nbd7", "exd5", "e8=Q+", "O-O".
+    legal_moves can pass in the legal move codes if they are already known.
+    '''
+    if legal_moves is None:
+        legal_moves = gs.get_valid_move_codes()
+    start = move & 63
+    end = (move >> 6) & 63
+    flags = move >> 12
+    if flags == ChessEngine.KING_CASTLE:
+        san = "O-O"
+    elif flags == ChessEngine.QUEEN_CASTLE:
+        san = "O-O-O"
+    else:
+        mailbox = gs.mailbox
+        piece_type = mailbox[start] % 6
+        capture = flags & ChessEngine.CAPTURE
+        if piece_type == PAWN:
+            san = ChessEngine.square_name(start)[0] + "x" if capture else ""
+        else:
+            san = PIECE_LETTERS[piece_type]
+            rivals = [other & 63 for other in legal_moves
+                      if (other >> 6) & 63 == end and other & 63 != start and mailbox[other & 63] % 6 == piece_type]
+            if rivals:
+                if all(rival & 7 != start & 7 for rival in rivals):
+                    san += ChessEngine.square_name(start)[0]
+                elif all(rival >> 3 != start >> 3 for rival in rivals):
+                    san += ChessEngine.square_name(start)[1]
+                else:
+                    san += ChessEngine.square_name(start)
+            if capture:
+                san += "x"
+        san += ChessEngine.square_name(end)
+        if flags & ChessEngine.PROMOTION:
+            san += "=" + PIECE_LETTERS[ChessEngine.PROMOTION_PIECES[flags & 3]]
+    gs.make_move(move)
+    replies = gs.get_valid_move_codes()
+    if gs.in_check:
+        san += "+" if replies else "#"
+    gs.undo_move()
+    return san
+
+
+def parse_san(gs, san, legal_moves=None):
+    '''Move code of a SAN string in the current position of gs. Raises ValueError if it is not legal.'''
+    if legal_moves is None:
+        legal_moves = gs.get_valid_move_codes()
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        flag = ChessEngine.KING_CASTLE if len(text) == 3 else ChessEngine.QUEEN_CASTLE
+        for move in legal_moves:
+            if move >> 12 == flag:
+                return move
+        raise ValueError("illegal move: " + san)
+
+    promotion = None
+    if "=" in text:
+        text, _, letter = text.partition("=")
+        promotion = PIECE_LETTERS.index(letter.upper())
+    elif len(text) > 2 and text[-1] in "NBRQ" and text[-2].isdigit():
+        promotion = PIECE_LETTERS.index(text[-1])
+        text = text[:-1]
+    if not text:
+        raise ValueError("bad SAN: " + san)
+    if text[0] in "NBRQK":
+        piece_type = PIECE_LETTERS.index(text[0])
+        text = text[1:]
+    else:
+        piece_type = PAWN
+    text = text.replace("x", "").replace("-", "")
+    if len(text) < 2:
+        raise ValueError("bad SAN: " + san)
+    try:
+        end = ChessEngine.square_index(text[-2:])
+    except KeyError:
+        raise ValueError("bad SAN: " + san)
+    hint = text[:-2]  # disambiguation: file, rank or both
+    mailbox = gs.mailbox
+    found = None
+    for move in legal_moves:
+        if (move >> 6) & 63 != end or mailbox[move & 63] % 6 != piece_type:
+            continue
+        flags = move >> 12
+        if promotion is not None:
+            if not flags & ChessEngine.PROMOTION or ChessEngine.PROMOTION_PIECES[flags & 3] != promotion:
+                continue
+        elif flags & ChessEngine.PROMOTION and ChessEngine.PROMOTION_PIECES[flags & 3] != QUEEN:
+            continue  # a promotion without a piece letter is taken as a queen
+        if hint:
+            start_name = ChessEngine.square_name(move & 63)
+            if any(char not in start_name for char in hint):
+                continue
+        if found is not None:
+            raise ValueError("ambiguous move: " + san)
+        found = move
+    if found is None:
+        raise ValueError("illegal move: " + san)
+    return found
+
+
+def move_log_to_san(gs):
+    '''SAN of every move in gs.move_log, replayed on a copy from the starting position.'''
+    start, moves = _start_position(gs)
+    sans = []
+    for move in moves:
+        sans.append(move_to_san(start, move))
+        start.make_move(move)
+    return sans
+
+
+def _start_position(gs):
+    '''(copy of gs with every move undone, the moves that were undone in order)'''
+    start = gs.copy()
+    moves = list(start.move_log)
+    while start.move_log:
+        start.undo_move()
+    return start, moves
+
+
+def game_result(gs):
+    '''"1-0", "0-1" or "1/2-1/2" if the game in gs is over by mate, stalemate or the 50 move rule, else "*".'''
+    if gs.get_valid_move_codes():
+        return "1/2-1/2" if gs.halfmove_clock >= 100 else "*"
+    if not gs.in_check:
+        return "1/2-1/2"
+    return "0-1" if gs.white_to_move else "1-0"
+
+
+def to_pgn(gs, headers=None, result=None):
+    '''
+    PGN text of the game in gs.move_log. headers is a dict of extra or overriding tags;
+    the result defaults to the one on the board.
+    '''
+    start, moves = _start_position(gs)
+    if result is None:
+        result = game_result(gs)
+    return moves_to_pgn(start, moves, result, headers)
+
+
+def moves_to_pgn(start, moves, result, headers=None):
+    '''
+    PGN text of the move codes played from start, a FEN or a GameState that is played forward.
+    For games recorded as a start position and a list of moves rather than in a GameState.
+    '''
+    if isinstance(start, str):
+        start = ChessEngine.GameState(start)
+    tags = dict(SEVEN_TAG_ROSTER)
+    tags["Result"] = result
+    start_fen = start.to_fen()
+    if start_fen != ChessEngine.START_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = start_fen
+    if headers:
+        tags.update(headers)
+    lines = ['[{} "{}"]'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+             for name, value in tags.items()]
+    lines.append("")
+
+    tokens = []
+    for i, move in enumerate(moves):
+        if start.white_to_move:
+            tokens.append("{}.".format(start.fullmove_number))
+        elif i == 0:
+            tokens.append("{}...".format(start.fullmove_number))
+        tokens.append(move_to_san(start, move))
+        start.make_move(move)
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def iter_pgn_games(source):
+    '''
+    Yield (headers, tokens) for every game of a PGN file, where tokens are the SAN moves of
+    the main line followed by the result. Comments, variations, NAGs and move numbers are
+    dropped. Only one game is held in memory at a time.
+    '''
+    headers = {}
+    tokens = []
+    in_comment = False
+    variation_depth = 0
+    for line in _open_lines(source):
+        if not in_comment:
+            stripped = line.strip()
+            if stripped.startswith("%"):
+                continue  # escape line
+            if stripped.startswith("["):
+                if tokens:  # a tag after movetext starts the next game
+                    yield headers, tokens
+                    headers = {}
+                    tokens = []
+                    variation_depth = 0
+                for match in _TAG_RE.finditer(stripped):
+                    headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                continue
+        for token in _TOKEN_RE.findall(line):
+            if in_comment:
+                if token == "}":
+                    in_comment = False
+                continue
+            if token == "{":
+                in_comment = True
+            elif token == ";":
+                break  # rest of line comment
+            elif token == "(":
+                variation_depth += 1
+            elif token == ")":
+                variation_depth = max(variation_depth - 1, 0)
+            elif variation_depth or token[0] == "$":
+                continue
+            elif token in RESULTS:
+                tokens.append(token)
+                yield headers, tokens
+                headers = {}
+                tokens = []
+            else:
+                token = _MOVE_NUMBER_RE.sub("", token)
+                if token and not token.isdigit():  # a move number written without its dot
+                    tokens.append(token)
+    if tokens or headers:
+        yield headers, tokens
+
+
+def replay_pgn(source, gs=None):
+    '''
+    Replay every game of a PGN file through make_move, one move at a time.
+    Yields (headers, gs, move) after each move is made on gs, which is reused for every game;
+    a game whose movetext has an illegal move raises ValueError.
+    '''
+    if gs is None:
+        gs = ChessEngine.GameState()
+    for headers, tokens in iter_pgn_games(source):
+        gs.load_fen(headers.get("FEN", ChessEngine.START_FEN))
+        for token in tokens:
+            if token in RESULTS:
+                break
+            move = parse_san(gs, token)
+            gs.make_move(move)
+            yield headers, gs, move
@@ -7,7 +7,11 @@ Git pulll
 
 import pygame as p
 import ChessEngine
+import ChessProfile
+import ChessWorker
+from ChessMoveCache import MoveCache
 import sys
+import time
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8
@@ -15,8 +19,11 @@ DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
 
 MAX_FPS = 15
+ENGINE_TIME_MS = 1000 #time the engine gets per move
     
 IMAGES = {}
+BOARD_SURFACE = None #the empty board, rendered once by load_images
+HIGHLIGHTS = {} #translucent square overlays by color name, made once
 
 
 def load_images():
@@ -25,6 +32,15 @@ def load_images():
     for piece in pieces:
         image_path = r'image\{}.png'.format(piece)
         IMAGES[piece] = p.transform.scale(p.image.load(image_path), (SQ_SIZE, SQ_SIZE))
+
+    global BOARD_SURFACE
+    BOARD_SURFACE = p.Surface((WIDTH, HEIGHT))
+    draw_board(BOARD_SURFACE)
+    for color in ('blue', 'yellow'):
+        h = p.Surface((SQ_SIZE, SQ_SIZE))
+        h.set_alpha(100) #transperancy
+        h.fill(p.Color(color))
+        HIGHLIGHTS[color] = h
         
         
 def main():
@@ -32,11 +48,12 @@ def main():
     The main driver for our code.
     This will handle user input and updating the graphics.
     '''
+    profile_path = ChessProfile.enable_from_env() #set CHESS_PROFILE=stats.json to time this session
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    gs = ChessEngine.GameState()
+    gs = ChessEngine.GameState(move_cache=MoveCache()) #undo/redo and repeated positions reuse their moves
     valid_moves = gs.get_valid_moves()
     move_made = False #flag variable for when a move is made
     
@@ -45,15 +62,28 @@ def main():
     running = True
     sq_selected = () #no square is selected initially, this will keep track of the last click of the user (tuple(row,col))
     player_clicks = [] #this will keep track of player clicks (two tuples)
+    player_one = True #True if a human is playing white, False if the engine is
+    player_two = True #same for black
+    worker = ChessWorker.EngineWorker() #searches on its own thread so drawing never waits
+    drawn = {} #what is on screen for each square, so only changed squares get redrawn
+    redraw = True #nothing is drawn unless an event arrived or the position changed
 
     while running:
+        frame_start = time.perf_counter()
+        human_turn = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two)
         for e in p.event.get():  
+            redraw = True
+            if e.type == p.VIDEOEXPOSE: #window contents were lost, draw everything again
+                drawn.clear()
             if e.type == p.QUIT:
                 running = False
+                if profile_path:
+                    ChessProfile.dump(profile_path)
+                worker.stop()
                 p.quit()
                 sys.exit()
             #mouse handler            
-            elif e.type == p.MOUSEBUTTONDOWN:
+            elif e.type == p.MOUSEBUTTONDOWN and human_turn:
                 location = p.mouse.get_pos() #(x, y) location of the mouse
                 col = location[0] // SQ_SIZE
                 row = location[1] // SQ_SIZE
@@ -65,55 +95,102 @@ def main():
                     player_clicks.append(sq_selected) #append for both 1st and 2nd click
                 if len(player_clicks) == 2: #after 2nd click                                                                    
                     move = ChessEngine.Move(player_clicks[0], player_clicks[1], gs.board)
-                    print(move.get_chess_notation)
-                    if move in valid_moves:
-                        print(move.get_chess_notation()) 
-                        gs.make_move(move)
-                        move_made = True
-                        sq_selected = () #reset user clicks
-                        player_clicks = []
-                    else:
+                    for i in range(len(valid_moves)):
+                        if move == valid_moves[i]: #play the generated move, it carries the capture/promotion flags
+                            print(valid_moves[i].get_chess_notation()) 
+                            worker.cancel()
+                            gs.make_move(valid_moves[i])
+                            move_made = True
+                            sq_selected = () #reset user clicks
+                            player_clicks = []
+                            break
+                    if not move_made:
                         player_clicks = [sq_selected]
             #key handler
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z: #undo when 'z' is pressed
+                    worker.cancel()
                     gs.undo_move()
                     move_made = True
+        ChessProfile.record("ChessMain.events", time.perf_counter() - frame_start)
+
+        #engine moves, polled without blocking
+        if not human_turn and not move_made and valid_moves:
+            if not worker.thinking:
+                worker.start_search(gs, time_ms=ENGINE_TIME_MS)
+            for kind, result in worker.poll():
+                if kind == ChessWorker.BESTMOVE and result.best_move is not None:
+                    gs.make_move(result.best_move)
+                    move_made = True
+                elif kind == ChessWorker.ERROR: #the engine failed on this position, let a human play this side
+                    if gs.white_to_move:
+                        player_one = True
+                    else:
+                        player_two = True
                     
         if move_made:
             valid_moves = gs.get_valid_moves()
             move_made = False
+            redraw = True
                     
-        draw_game_state(screen, gs, valid_moves, sq_selected) 
+        if redraw:
+            render_start = time.perf_counter()
+            dirty = draw_game_state(screen, gs, valid_moves, sq_selected, drawn) 
+            if dirty:
+                p.display.update(dirty)
+            redraw = False
+            ChessProfile.record("ChessMain.render", time.perf_counter() - render_start)
+        ChessProfile.record("ChessMain.frame", time.perf_counter() - frame_start) #work done, without the wait below
         clock.tick(MAX_FPS)
-        p.display.flip()
 
-def high_light(screen, gs, valid_moves, sq_selected):
+def high_light(gs, valid_moves, sq_selected):
+    '''
+    Highlight color of each highlighted square: the selected square and where it can move to.
+    '''
+    highlights = {}
     if sq_selected != ():
         r, c = sq_selected
         if gs.board[r][c][0] == ('w' if gs.white_to_move else 'b'): #sq_selected is the sq that can be moved
-            h = p.Surface((SQ_SIZE, SQ_SIZE)) #highlight the selected sq
-            h.set_alpha(100) #transperancy
-            h.fill(p.Color('blue'))
-            screen.blit(h, (c*SQ_SIZE, r*SQ_SIZE))
+            highlights[(r, c)] = 'blue' #highlight the selected sq
             #highlight moves
-            h.fill(p.Color('yellow'))
             for move in valid_moves:
                 if move.start_row == r and move.start_col == c:
-                    screen.blit(h, (SQ_SIZE*move.end_col, SQ_SIZE*move.end_row))
+                    highlights[(move.end_row, move.end_col)] = 'yellow'
+    return highlights
 
 
-def draw_game_state(screen, gs, valid_moves, sq_selected):
+def draw_game_state(screen, gs, valid_moves, sq_selected, drawn):
     '''
     Responsible for all the graphics within current game state.
+    Only squares whose piece or highlight differs from drawn (what is on screen) are redrawn,
+    drawn is updated and the list of changed rects is returned for display.update.
+    '''
+    board = gs.board
+    highlights = high_light(gs, valid_moves, sq_selected)
+    dirty = []
+    for row in range(DIMENSION):
+        for column in range(DIMENSION):
+            square = (board[row][column], highlights.get((row, column)))
+            if drawn.get((row, column)) != square:
+                dirty.append(draw_square(screen, row, column, square[0], square[1]))
+                drawn[(row, column)] = square
+    return dirty
+
+def draw_square(screen, row, column, piece, highlight):
+    '''
+    Draw one square: the cached board, then the highlight and the piece on top.
     '''
-    draw_board(screen) #draw squares on the board
-    high_light(screen, gs, valid_moves, sq_selected)
-    draw_pieces(screen, gs.board) #draw pieces on top of those squares      
+    rect = p.Rect(column*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    screen.blit(BOARD_SURFACE, rect, rect)
+    if highlight is not None:
+        screen.blit(HIGHLIGHTS[highlight], rect)
+    if piece != "--":
+        screen.blit(IMAGES[piece], rect)
+    return rect
 
 def draw_board(screen):
     '''
-    Draw the squares on the board.
+    Draw the squares on the board, done once into BOARD_SURFACE.
     The top left square is always light.
     '''
     colors = [p.Color("white"), p.Color("gray")]
@@ -123,16 +200,6 @@ def draw_board(screen):
             p.draw.rect(screen, color, p.Rect(column*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
     
 
-def draw_pieces(screen, board):
-    '''
-    Draw the pieces on the board using the current game_state.board
-    '''
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            piece = board[row][column]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(column*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-         
                 
 if __name__ == "__main__":
     main()
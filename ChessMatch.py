@@ -0,0 +1,269 @@
+'''
+Headless self-play and matches between two players, over a process pool.
+Used as the end to end load test and to compare the strength of two engine settings.
+
+    python ChessMatch.py random depth:2 --games 100
+    python ChessMatch.py time:100 depth:3 --games 200 --processes 8 --pgn games.pgn --results games.jsonl
+    python ChessMatch.py nodes:5000 nodes:5000@tuned.json --openings openings.fen --random-plies 4
+
+A player is "random", "depth:N", "time:MS" or "nodes:N". A searching player may add
+"@weights.json" to evaluate with those weights, so "depth:3@tuned.json" against "depth:3"
+compares two evaluations. The players swap colors every game, and with --openings every
+opening is played once with each color. Games are written to the PGN and JSON lines files as
+they finish; the summary at the end gives the score of the first player, games/s, nodes/s and
+the move latency percentiles of each player.
+'''
+
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+import ChessEngine
+import ChessIO
+import ChessSearch
+from ChessBitboard import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, popcount
+from ChessEvaluation import EvalWeights, Evaluator
+from ChessTransposition import TranspositionTable
+
+DEFAULT_MAX_PLIES = 400
+PERCENTILES = (50, 90, 99)
+
+_worker_tt_size_mb = 4  # set by _init_worker
+_evaluators = {}  # weights path -> Evaluator, loaded once per process
+
+
+def _init_worker(tt_size_mb):
+    global _worker_tt_size_mb
+    _worker_tt_size_mb = tt_size_mb
+
+
+def load_evaluator(path):
+    '''Evaluator with the weights in a JSON file, shared by every player of the process using it.'''
+    evaluator = _evaluators.get(path)
+    if evaluator is None:
+        evaluator = _evaluators[path] = Evaluator(EvalWeights.load(path))
+    return evaluator
+
+
+class Player():
+    '''
+    A move chooser parsed from a spec string such as "depth:3" or "depth:3@tuned.json".
+    Raises ValueError for a bad spec, OSError if the weights file cannot be read.
+    '''
+    KINDS = ("random", "depth", "time", "nodes")
+
+    def __init__(self, spec):
+        limit, _, weights_path = spec.partition("@")
+        kind, _, value = limit.partition(":")
+        if kind not in self.KINDS or (kind == "random") != (value == "") or (kind == "random" and weights_path):
+            raise ValueError("bad player: " + spec)
+        self.spec = spec
+        self.kind = kind
+        self.value = int(value) if value else None
+        self.evaluator = load_evaluator(weights_path) if weights_path else None  # None for the default weights
+        self.tt = None
+
+    def new_game(self, tt_size_mb):
+        '''Fresh transposition table, so no game depends on the ones before it.'''
+        if self.kind != "random":
+            self.tt = TranspositionTable(tt_size_mb)
+
+    def choose(self, gs, rng):
+        '''(move code, nodes searched)'''
+        if self.kind == "random":
+            return rng.choice(gs.get_valid_move_codes()), 0
+        searcher = ChessSearch.Searcher(gs, self.tt, self.evaluator)
+        if self.kind == "depth":
+            result = searcher.search(self.value)
+        elif self.kind == "time":
+            result = searcher.search(time_ms=self.value)
+        else:
+            result = searcher.search(nodes=self.value)
+        return result.best_move, result.nodes
+
+
+def game_over(gs):
+    '''(result, reason) if the game in gs is finished, else None.'''
+    if not gs.get_valid_move_codes():
+        if gs.in_check:
+            return ("0-1" if gs.white_to_move else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    if gs.halfmove_clock >= 100:
+        return "1/2-1/2", "fifty moves"
+    if gs.repetition_count() >= 3:
+        return "1/2-1/2", "repetition"
+    if insufficient_material(gs):
+        return "1/2-1/2", "insufficient material"
+    return None
+
+
+def insufficient_material(gs):
+    '''Only kings, or kings and a single knight or bishop.'''
+    pieces = gs.pieces
+    for piece_type in (PAWN, ROOK, QUEEN):
+        if pieces[WHITE*6 + piece_type] or pieces[BLACK*6 + piece_type]:
+            return False
+    minors = 0
+    for piece_type in (KNIGHT, BISHOP):
+        minors += popcount(pieces[WHITE*6 + piece_type]) + popcount(pieces[BLACK*6 + piece_type])
+    return minors <= 1
+
+
+def play_game(task):
+    '''
+    Play one game. Runs in a worker process.
+    Returns a dict with the result, the PGN text, the nodes and the time of every move.
+    '''
+    index, white_spec, black_spec, fen, random_plies, max_plies, seed = task
+    rng = random.Random(seed)
+    players = (Player(white_spec), Player(black_spec))
+    for player in players:
+        player.new_game(_worker_tt_size_mb)
+    gs = ChessEngine.GameState(fen)
+    for _ in range(random_plies):
+        moves = gs.get_valid_move_codes()
+        if not moves:
+            break
+        gs.make_move(rng.choice(moves))
+    opening = gs.to_fen()  # the game proper starts here
+    played = []
+
+    start = time.perf_counter()
+    latencies = ([], [])  # seconds per move, by color
+    nodes = [0, 0]
+    result = None
+    while result is None:
+        result = game_over(gs)
+        if result is not None:
+            break
+        if len(played) >= max_plies:
+            result = ("*", "max plies")
+            break
+        color = WHITE if gs.white_to_move else BLACK
+        move_start = time.perf_counter()
+        move, searched = players[color].choose(gs, rng)
+        latencies[color].append(time.perf_counter() - move_start)
+        nodes[color] += searched
+        played.append(move)
+        gs.make_move(move)
+    headers = {"Event": "ChessMatch", "Round": str(index + 1), "White": white_spec, "Black": black_spec,
+               "Termination": result[1]}
+    return {"index": index, "white": white_spec, "black": black_spec, "result": result[0], "reason": result[1],
+            "plies": len(played), "nodes": nodes, "latencies": latencies,
+            "elapsed": time.perf_counter() - start,
+            "pgn": ChessIO.moves_to_pgn(opening, played, result[0], headers)}
+
+
+def make_tasks(first, second, games, openings, random_plies, max_plies, seed):
+    '''Game tasks with the players swapping colors every game, each opening played with both colors.'''
+    for index in range(games):
+        fen = openings[(index // 2) % len(openings)] if openings else ChessEngine.START_FEN
+        if index % 2 == 0:
+            white, black = first, second
+        else:
+            white, black = second, first
+        # both games of an opening pair get the same random plies
+        yield (index, white, black, fen, random_plies, max_plies, seed * 1000003 + index // 2)
+
+
+def percentile(sorted_values, percent):
+    '''Nearest rank percentile of an already sorted list.'''
+    if not sorted_values:
+        return 0.0
+    rank = max(int(len(sorted_values) * percent / 100.0 + 0.5), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_match(first, second, games, processes=None, openings=None, random_plies=0,
+              max_plies=DEFAULT_MAX_PLIES, seed=1, tt_size_mb=4):
+    '''Yield the result dict of every game as it finishes, in any order.'''
+    for spec in (first, second):
+        Player(spec)  # a bad spec or weights file raises here, not in every worker
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(tt_size_mb,))
+    try:
+        tasks = make_tasks(first, second, games, openings, random_plies, max_plies, seed)
+        for game in pool.imap_unordered(play_game, tasks):
+            yield game
+    finally:
+        pool.terminate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play games between two players on all cores")
+    parser.add_argument("first", help='"random", "depth:N", "time:MS" or "nodes:N", optionally followed by '
+                                      '"@weights.json"')
+    parser.add_argument("second")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--openings", default=None, help="FEN or EPD file of start positions")
+    parser.add_argument("--random-plies", type=int, default=0, help="random moves before the players take over")
+    parser.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tt-size-mb", type=int, default=4, help="per player")
+    parser.add_argument("--pgn", default=None, help="append the games to this PGN file")
+    parser.add_argument("--results", default=None, help="append one JSON line per game to this file")
+    args = parser.parse_args(argv)
+    try:
+        Player(args.first)
+        Player(args.second)
+    except (ValueError, OSError) as error:
+        parser.error(str(error))
+    openings = [gs.to_fen() for gs, _ in ChessIO.iter_epd(args.openings)] if args.openings else None
+
+    pgn_file = open(args.pgn, "a") if args.pgn else None
+    results_file = open(args.results, "a") if args.results else None
+    score = {"win": 0, "draw": 0, "loss": 0}  # of the first player
+    latencies = {args.first: [], args.second: []} if args.first != args.second else {args.first: []}
+    total_nodes = 0
+    finished = 0
+    start = time.time()
+    try:
+        for game in run_match(args.first, args.second, args.games, args.processes, openings,
+                              args.random_plies, args.max_plies, args.seed, args.tt_size_mb):
+            finished += 1
+            total_nodes += sum(game["nodes"])
+            latencies[game["white"]].extend(game["latencies"][0])
+            latencies[game["black"]].extend(game["latencies"][1])
+            first_is_white = game["index"] % 2 == 0
+            if game["result"] in ("1-0", "0-1"):
+                won = (game["result"] == "1-0") == first_is_white
+                score["win" if won else "loss"] += 1
+            else:
+                score["draw"] += 1
+            print("game {} {} - {} {} ({}, {} plies)".format(
+                game["index"] + 1, game["white"], game["black"], game["result"], game["reason"], game["plies"]))
+            if pgn_file is not None:
+                pgn_file.write(game["pgn"] + "\n")
+                pgn_file.flush()
+            if results_file is not None:
+                record = {key: value for key, value in game.items() if key not in ("pgn", "latencies")}
+                record["moves"] = [len(game["latencies"][0]), len(game["latencies"][1])]
+                results_file.write(json.dumps(record) + "\n")
+                results_file.flush()
+    finally:
+        if pgn_file is not None:
+            pgn_file.close()
+        if results_file is not None:
+            results_file.close()
+
+    elapsed = time.time() - start
+    points = score["win"] + score["draw"] / 2.0
+    print("{} vs {}: +{} ={} -{} ({:.1f}/{})".format(
+        args.first, args.second, score["win"], score["draw"], score["loss"], points, finished), file=sys.stderr)
+    print("{} games {:.1f}s {:.2f} games/s {:.0f} nodes/s".format(
+        finished, elapsed, finished / elapsed if elapsed > 0 else 0.0,
+        total_nodes / elapsed if elapsed > 0 else 0.0), file=sys.stderr)
+    for spec, times in latencies.items():
+        times.sort()
+        print("{} move latency ms: {} max {:.1f} ({} moves)".format(
+            spec, " ".join("p{} {:.1f}".format(percent, percentile(times, percent) * 1000.0)
+                           for percent in PERCENTILES),
+            times[-1] * 1000.0 if times else 0.0, len(times)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+'''
+Bounded LRU cache of legal move lists keyed by GameState.zobrist_key.
+Legal moves only depend on what the Zobrist key covers (pieces, side to move, castling rights
+and a capturable en passant square), so a position reached again, by undo/redo or a repetition,
+gets its moves without generating them. Only the full move list (GEN_ALL) is cached: the search
+generates its moves in stages (GEN_NOISY, GEN_QUIET), which are cheaper to regenerate than to
+look up, so the engine searches without a cache.
+
+    gs = GameState(move_cache=MoveCache())
+'''
+
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 4096
+
+
+class MoveCache():
+    '''
+    Entries are (move codes tuple, in check, checkers bitboard) as set by GameState.get_valid_move_codes.
+    The least recently used entry is dropped once max_entries are stored. A lock guards the
+    entries since GameState.copy() shares the cache with copies that may be used on other threads.
+    '''
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            entries = self.entries
+            entries[key] = entry
+            entries.move_to_end(key)
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
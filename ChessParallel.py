@@ -0,0 +1,192 @@
+'''
+Multi-process search, to get past the GIL.
+
+    parallel_search(gs, time_ms=5000)       # root split of one position over all cores
+    for fen, result in analyze_batch(fens, depth=4):
+        ...                                  # many positions, one per task, over all cores
+
+Positions go to the worker processes as FEN strings or GameState.pack() bytes, never as
+pickled GameState objects. Every worker process keeps one transposition table for its lifetime.
+The workers evaluate with the weights given to create_pool(), the defaults if none.
+
+    python ChessParallel.py positions.fen --depth 4 --processes 32 --weights tuned.json
+'''
+
+import argparse
+import multiprocessing
+import sys
+import time
+
+import ChessEngine
+import ChessSearch
+from ChessEvaluation import EvalWeights, Evaluator
+from ChessTransposition import TranspositionTable
+
+_worker_tt = None  # per process transposition table, set by _init_worker
+_worker_evaluator = None  # per process evaluator, None for the default weights
+
+
+def make_evaluator(weights):
+    '''Evaluator for an EvalWeights or the path of a JSON weights file, None for the defaults.'''
+    if weights is None:
+        return None
+    if not isinstance(weights, EvalWeights):
+        weights = EvalWeights.load(weights)
+    return Evaluator(weights)
+
+
+def _init_worker(tt_size_mb, weights=None):
+    global _worker_tt, _worker_evaluator
+    _worker_tt = TranspositionTable(tt_size_mb)
+    _worker_evaluator = make_evaluator(weights)
+
+
+def _search_root_move(task):
+    '''Search the position after one root move. Runs in a worker process.'''
+    packed, move, depth, deadline, nodes = task
+    gs = ChessEngine.GameState.unpack(packed)
+    gs.make_move(move)
+    time_ms = max(0.0, (deadline - time.time()) * 1000.0) if deadline is not None else None
+    result = ChessSearch.Searcher(gs, _worker_tt, _worker_evaluator).search(depth, time_ms, nodes)
+    return move, result
+
+
+def _search_position(task):
+    '''Search a packed position from its root. Runs in a worker process.'''
+    packed, depth, time_ms, nodes = task
+    gs = ChessEngine.GameState.unpack(packed)
+    return ChessSearch.Searcher(gs, _worker_tt, _worker_evaluator).search(depth, time_ms, nodes)
+
+
+def _analyze_fen(task):
+    '''Search one FEN position. Runs in a worker process.'''
+    fen, depth, time_ms, nodes = task
+    gs = ChessEngine.GameState(fen)
+    return fen, ChessSearch.Searcher(gs, _worker_tt, _worker_evaluator).search(depth, time_ms, nodes)
+
+
+def _parent_score(child_score):
+    '''Negate a child's score, moving mate scores one ply further from the root.'''
+    score = -child_score
+    if score > ChessSearch.MATE_BOUND:
+        score -= 1
+    elif score < -ChessSearch.MATE_BOUND:
+        score += 1
+    return score
+
+
+def create_pool(processes=None, tt_size_mb=16, weights=None):
+    '''
+    Process pool whose workers each own a tt_size_mb transposition table.
+    weights, an EvalWeights or the path of a JSON weights file, is loaded once per worker.
+    '''
+    make_evaluator(weights)  # a bad weights file raises here, not in every worker
+    return multiprocessing.Pool(processes, initializer=_init_worker, initargs=(tt_size_mb, weights))
+
+
+def parallel_search(gs, depth=ChessSearch.MAX_PLY, time_ms=None, nodes=None, pool=None, info=None, weights=None):
+    '''
+    Root split iterative deepening: each iteration searches every root move in its own task,
+    so all processes work on the same position. nodes is a limit per root move task.
+    Returns a ChessSearch.SearchResult of the deepest iteration whose root moves all finished.
+    A depth of 1 leaves nothing to split and is searched whole in one worker.
+    weights is used when no pool is given; a pool evaluates with the weights it was created with.
+    '''
+    start = time.time()
+    deadline = start + time_ms / 1000.0 if time_ms is not None else None
+    root_moves = list(gs.get_valid_move_codes())
+    if not root_moves:
+        return ChessSearch.SearchResult(None, -ChessSearch.MATE_SCORE if gs.in_check else 0, 0, 0, 0.0, [])
+    own_pool = pool is None
+    if own_pool:
+        pool = create_pool(weights=weights)
+    packed = gs.pack()
+    best = ChessSearch.SearchResult(root_moves[0], 0, 0, 0, 0.0, [root_moves[0]])
+    total_nodes = 0
+    try:
+        if depth <= 1:
+            best = pool.apply(_search_position, ((packed, 1, time_ms, nodes),))
+            total_nodes = best.nodes
+            if info is not None and best.depth:
+                info(best)
+        # the children are searched one ply shallower than the root
+        for child_depth in range(1, depth):
+            tasks = [(packed, move, child_depth, deadline, nodes) for move in root_moves]
+            results = pool.map(_search_root_move, tasks, chunksize=1)
+            total_nodes += sum(result.nodes for move, result in results)
+            # a child result shallower than asked means its task ran out of time
+            if any(result.depth < child_depth and result.best_move is not None for move, result in results):
+                break
+            move, child = min(results, key=lambda item: item[1].score)
+            best = ChessSearch.SearchResult(move, _parent_score(child.score), child_depth + 1, total_nodes,
+                                            time.time() - start, [move] + child.pv)
+            # the next iteration searches the best moves first, so they get time before the deadline
+            root_moves = [move for move, result in sorted(results, key=lambda item: item[1].score)]
+            if info is not None:
+                info(best)
+            if deadline is not None and time.time() >= deadline:
+                break
+    finally:
+        if own_pool:
+            pool.terminate()
+    best.nodes = total_nodes
+    best.elapsed = time.time() - start
+    return best
+
+
+def analyze_batch(fens, depth=ChessSearch.MAX_PLY, time_ms=None, nodes=None, pool=None, chunksize=4,
+                  weights=None):
+    '''
+    Search many positions in parallel, one position per task.
+    Yields (fen, SearchResult) in input order as results come in; fens may be any iterable.
+    weights is used when no pool is given, as in parallel_search().
+    '''
+    own_pool = pool is None
+    if own_pool:
+        pool = create_pool(weights=weights)
+    try:
+        tasks = ((fen, depth, time_ms, nodes) for fen in fens)
+        for item in pool.imap(_analyze_fen, tasks, chunksize):
+            yield item
+    finally:
+        if own_pool:
+            pool.terminate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a file of FEN positions on all cores")
+    parser.add_argument("fen_file", help="one FEN per line")
+    parser.add_argument("--depth", type=int, default=ChessSearch.MAX_PLY)
+    parser.add_argument("--time-ms", type=int, default=None, help="per position")
+    parser.add_argument("--nodes", type=int, default=None, help="per position")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--weights", default=None, help="JSON file of evaluation weights")
+    args = parser.parse_args(argv)
+    if args.depth == ChessSearch.MAX_PLY and args.time_ms is None and args.nodes is None:
+        parser.error("set at least one of --depth, --time-ms or --nodes")
+
+    start = time.time()
+    count = 0
+    total_nodes = 0
+    with open(args.fen_file) as f:
+        fens = (line.strip() for line in f if line.strip())
+        pool = create_pool(args.processes, weights=args.weights)
+        try:
+            for fen, result in analyze_batch(fens, args.depth, args.time_ms, args.nodes, pool):
+                gs = ChessEngine.GameState(fen)
+                move = ChessEngine.Move.from_code(result.best_move, gs).get_chess_notation() \
+                    if result.best_move is not None else "none"
+                print("{}\t{}\t{}\t{}".format(fen, move, result.score, result.depth))
+                count += 1
+                total_nodes += result.nodes
+        finally:
+            pool.terminate()
+    elapsed = time.time() - start
+    print("{} positions {:.1f}s {:.1f} positions/s {:.0f} nps".format(
+        count, elapsed, count / elapsed if elapsed > 0 else 0.0,
+        total_nodes / elapsed if elapsed > 0 else 0.0), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
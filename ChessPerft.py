@@ -0,0 +1,170 @@
+'''
+Perft: counts the leaf nodes of the legal move tree to a fixed depth.
+Used to check GameState.get_valid_moves / make_move / undo_move against published counts
+and to measure move generation throughput.
+
+    python ChessPerft.py 4                      # perft 4 from the starting position
+    python ChessPerft.py 3 --fen "<fen>" --divide
+    python ChessPerft.py --suite                # check the standard positions
+    python ChessPerft.py --check-batch          # check ChessBatch against GameState (needs numpy)
+'''
+
+import argparse
+import random
+import sys
+import time
+
+import ChessEngine
+
+START_FEN = ChessEngine.START_FEN
+
+# (name, fen, [node count at depth 1, 2, ...]) from https://www.chessprogramming.org/Perft_Results
+STANDARD_POSITIONS = [
+    ("start", START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def perft(gs, depth):
+    '''Number of leaf nodes depth plies below the current position.'''
+    return _perft(gs, depth, [[] for _ in range(depth + 1)])
+
+
+def _perft(gs, depth, buffers):
+    # one reusable move buffer per ply, so the recursion allocates no move lists
+    if depth == 0:
+        return 1
+    moves = gs.get_valid_move_codes(buffers[depth])
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.make_move(move)
+        nodes += _perft(gs, depth - 1, buffers)
+        gs.undo_move()
+    return nodes
+
+
+def divide(gs, depth):
+    '''List of (move notation, leaf nodes) for every root move.'''
+    result = []
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        result.append((move.get_chess_notation(), perft(gs, depth - 1)))
+        gs.undo_move()
+    return result
+
+
+def timed_perft(gs, depth):
+    '''(nodes, seconds, nodes per second)'''
+    start = time.perf_counter()
+    nodes = perft(gs, depth)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed, nodes / elapsed if elapsed > 0 else 0.0
+
+
+def run_suite(max_nodes=100000, out=sys.stdout):
+    '''
+    Run perft on every standard position up to the deepest depth whose expected count
+    is at most max_nodes. Returns True if every count matched.
+    '''
+    all_ok = True
+    for name, fen, counts in STANDARD_POSITIONS:
+        for depth, expected in enumerate(counts, 1):
+            if expected > max_nodes and depth > 1:
+                break
+            nodes, elapsed, nps = timed_perft(ChessEngine.GameState(fen), depth)
+            ok = nodes == expected
+            all_ok = all_ok and ok
+            out.write("{:<10} depth {} {:>10} nodes (expected {:>10}) {:>9.0f} nps  {}\n".format(
+                name, depth, nodes, expected, nps, "ok" if ok else "FAIL"))
+    return all_ok
+
+
+def random_positions(count, seed=1):
+    '''count GameState copies met in random games from the standard positions, with their history.'''
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        gs = ChessEngine.GameState(rng.choice(STANDARD_POSITIONS)[1])
+        for _ in range(rng.randrange(1, 120)):
+            moves = gs.get_valid_move_codes()
+            if not moves or len(positions) >= count:
+                break
+            positions.append(gs.copy())
+            gs.make_move(rng.choice(moves))
+    return positions
+
+
+def run_batch_check(count=2000, seed=1, out=sys.stdout):
+    '''
+    Compare ChessBatch.legal_move_counts, in_check and evaluate with GameState on count random
+    positions. Returns True if they all agree.
+    '''
+    import ChessBatch  # numpy is only needed for this check
+    from ChessEvaluation import MAX_PHASE
+
+    states = random_positions(count, seed)
+    batch = ChessBatch.BoardBatch.from_states(states)
+    counts = ChessBatch.legal_move_counts(batch)
+    checks = ChessBatch.in_check(batch)
+    scores = ChessBatch.evaluate(batch)
+    failures = 0
+    for i, gs in enumerate(states):
+        mg, eg = (gs.mg_score, gs.eg_score) if gs.white_to_move else (-gs.mg_score, -gs.eg_score)
+        phase = min(gs.phase, MAX_PHASE)
+        expected = (len(gs.get_valid_move_codes()), bool(gs.get_checkers()),
+                    (mg*phase + eg*(MAX_PHASE - phase)) // MAX_PHASE)
+        found = (int(counts[i]), bool(checks[i]), int(scores[i]))
+        if found != expected:
+            failures += 1
+            out.write("{}  batch {} engine {}  FAIL\n".format(gs.to_fen(), found, expected))
+    out.write("{} positions, {} mismatches\n".format(len(states), failures))
+    return failures == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft driver for ChessEngine.GameState")
+    parser.add_argument("depth", type=int, nargs="?", default=3)
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--divide", action="store_true", help="print the leaf count below each root move")
+    parser.add_argument("--suite", action="store_true", help="check the standard perft positions")
+    parser.add_argument("--max-nodes", type=int, default=100000,
+                        help="deepest suite depth to run, by expected node count")
+    parser.add_argument("--check-batch", action="store_true",
+                        help="check ChessBatch move counts, check detection and evaluation against GameState")
+    parser.add_argument("--positions", type=int, default=2000, help="random positions for --check-batch")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if run_suite(args.max_nodes) else 1
+    if args.check_batch:
+        return 0 if run_batch_check(args.positions) else 1
+
+    gs = ChessEngine.GameState(args.fen)
+    start = time.perf_counter()
+    if args.divide:
+        nodes = 0
+        for notation, count in divide(gs, args.depth):
+            print("{}: {}".format(notation, count))
+            nodes += count
+    else:
+        nodes = perft(gs, args.depth)
+    elapsed = time.perf_counter() - start
+    print("depth {} nodes {} time {:.3f}s nps {:.0f}".format(
+        args.depth, nodes, elapsed, nodes / elapsed if elapsed > 0 else 0.0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
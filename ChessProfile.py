@@ -0,0 +1,185 @@
+'''
+Opt-in call counting and timing of the engine hot paths and the UI loop.
+
+    ChessProfile.enable()     # before creating the GameStates to watch
+    ...
+    ChessProfile.snapshot()   # {name: {"calls", "total_ms", "mean_us", "max_us"}}
+    ChessProfile.dump("stats.json")
+
+enable() swaps timing wrappers in for the GameState and Move methods listed below and disable()
+puts the originals back, so nothing at all runs while profiling is off. A GameState binds its
+per-piece generators in move_functions; every state seen while profiling (created, or used
+through one of its entry points) is kept in a weak set, and disable() rebinds their generators
+to the original methods. Code outside the engine (ChessMain's frame, event and render times)
+reports through record(), which returns at once while profiling is off.
+
+Setting the CHESS_PROFILE environment variable to a path makes ChessMain profile the session
+and dump the stats there on exit.
+'''
+
+import functools
+import json
+import os
+import threading
+import time
+import weakref
+
+import ChessEngine
+
+GAMESTATE_METHODS = ("get_valid_moves", "get_valid_move_codes", "find_pinsAndChecks", "make_move", "undo_move",
+                     "get_pawn_moves", "get_knight_moves", "get_bishop_moves", "get_rook_moves",
+                     "get_queen_moves", "get_king_moves")
+MOVE_METHODS = ("__init__", "from_code")
+# entry points that bring a GameState made before enable() under watch, so its generators are timed too
+WATCH_METHODS = ("get_valid_moves", "get_valid_move_codes", "find_pinsAndChecks")
+
+_enabled = False
+_originals = []  # (class, attribute name, original attribute) while enabled
+_local = threading.local()  # each thread counts into its own dict, merged by snapshot()
+_all_stats = []
+_stats_lock = threading.Lock()
+_states = weakref.WeakSet()  # GameStates whose move_functions are bound to the timing wrappers
+
+
+def _thread_stats():
+    stats = {}
+    _local.stats = stats
+    with _stats_lock:
+        _all_stats.append(stats)
+    return stats
+
+
+def _add(name, elapsed):
+    try:
+        stats = _local.stats
+    except AttributeError:
+        stats = _thread_stats()
+    entry = stats.get(name)
+    if entry is None:
+        entry = stats[name] = [0, 0.0, 0.0]  # calls, total seconds, longest call
+    entry[0] += 1
+    entry[1] += elapsed
+    if elapsed > entry[2]:
+        entry[2] = elapsed
+
+
+def _timed(name, func):
+    perf_counter = time.perf_counter
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _add(name, perf_counter() - start)
+    return wrapper
+
+
+def _watch(gs):
+    '''Bind the generators of gs to the timing wrappers, and remember it for disable().'''
+    if gs not in _states:
+        _states.add(gs)
+        gs.bind_move_functions()
+
+
+def _watched(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        _watch(self)
+        return func(self, *args, **kwargs)
+    return wrapper
+
+
+def _patch(cls, attribute, wrap=None):
+    original = cls.__dict__[attribute]
+    name = "{}.{}".format(cls.__name__, attribute)
+    if wrap is not None:
+        wrapped = wrap(original)
+    elif isinstance(original, classmethod):
+        wrapped = classmethod(_timed(name, original.__func__))
+    else:
+        wrapped = _timed(name, original)
+    _originals.append((cls, attribute, original))
+    setattr(cls, attribute, wrapped)
+
+
+def _init_watched(init):
+    @functools.wraps(init)
+    def wrapper(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        _states.add(self)  # __init__ bound the timing wrappers already
+    return wrapper
+
+
+def enable():
+    global _enabled
+    if _enabled:
+        return
+    for attribute in GAMESTATE_METHODS:
+        _patch(ChessEngine.GameState, attribute)
+    for attribute in WATCH_METHODS:
+        _patch(ChessEngine.GameState, attribute, _watched)
+    _patch(ChessEngine.GameState, "__init__", _init_watched)
+    for attribute in MOVE_METHODS:
+        _patch(ChessEngine.Move, attribute)
+    _enabled = True
+
+
+def disable():
+    '''Put the original methods back, also in the move_functions of every GameState seen while enabled.'''
+    global _enabled
+    while _originals:
+        cls, attribute, original = _originals.pop()
+        setattr(cls, attribute, original)
+    for gs in list(_states):
+        gs.bind_move_functions()
+    _states.clear()
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable_from_env(variable="CHESS_PROFILE"):
+    '''Enable profiling if the environment variable is set. Returns its value, the dump path, or None.'''
+    path = os.environ.get(variable)
+    if path:
+        enable()
+    return path or None
+
+
+def record(name, seconds):
+    '''Add one timed event measured by the caller, e.g. a UI frame. Does nothing while profiling is off.'''
+    if _enabled:
+        _add(name, seconds)
+
+
+def reset():
+    with _stats_lock:
+        for stats in _all_stats:
+            stats.clear()
+
+
+def snapshot():
+    '''Stats of every thread so far, by name.'''
+    merged = {}
+    with _stats_lock:
+        for stats in _all_stats:
+            for name, (calls, total, longest) in list(stats.items()):
+                entry = merged.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += calls
+                entry[1] += total
+                entry[2] = max(entry[2], longest)
+    return {name: {"calls": calls,
+                   "total_ms": round(total * 1000.0, 3),
+                   "mean_us": round(total / calls * 1e6, 3) if calls else 0.0,
+                   "max_us": round(longest * 1e6, 3)}
+            for name, (calls, total, longest) in sorted(merged.items())}
+
+
+def dump(path):
+    '''Write snapshot() to path as JSON, with the time it was taken.'''
+    with open(path, "w") as f:
+        json.dump({"time": time.time(), "stats": snapshot()}, f, indent=1)
@@ -0,0 +1,297 @@
+'''
+Alpha-beta search on top of ChessEngine.GameState.
+Negamax with iterative deepening, a principal variation table, a transposition table,
+quiescence search on captures and staged move generation: hash move, captures by MVV-LVA,
+killers, then quiet moves by history, so a cutoff skips generating the later stages.
+A search stops on a hard time or node limit.
+
+    result = ChessSearch.find_best_move(gs, time_ms=500)
+    gs.make_move(result.best_move)
+'''
+
+import time
+
+from ChessBitboard import PAWN, WHITE, BLACK
+from ChessEngine import CAPTURE, EN_PASSANT, PROMOTION, PROMOTION_PIECES, GEN_NOISY, GEN_QUIET
+from ChessEvaluation import evaluate, DEFAULT_WEIGHTS
+from ChessTransposition import TranspositionTable, EXACT, LOWER, UPPER
+
+MATE_SCORE = 100000
+MATE_BOUND = MATE_SCORE - 1000  # scores beyond this are mates
+INFINITY = MATE_SCORE + 1
+MAX_PLY = 128
+
+PIECE_VALUES = DEFAULT_WEIGHTS.mg_values  # for move ordering only
+
+
+class SearchTimeout(Exception):
+    '''Raised inside the search when the time or node limit is reached.'''
+
+
+def score_to_tt(score, ply):
+    '''Mate scores are stored relative to the node, not the root.'''
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class SearchResult():
+    def __init__(self, best_move, score, depth, nodes, elapsed, pv):
+        self.best_move = best_move  # move code, None if there is no legal move
+        self.score = score  # centipawns for the side to move, +-MATE_SCORE minus plies for mates
+        self.depth = depth  # deepest fully searched iteration
+        self.nodes = nodes
+        self.elapsed = elapsed  # seconds
+        self.pv = pv  # list of move codes
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    def __repr__(self):
+        return "SearchResult(depth={}, score={}, nodes={}, nps={}, pv={})".format(
+            self.depth, self.score, self.nodes, self.nps, self.pv)
+
+
+class Searcher():
+    '''
+    Searches one GameState. The state is modified during the search and restored before
+    search() returns, including when a limit interrupts it.
+    The transposition table is kept between searches; pass one in to share or size it.
+    evaluator is any callable scoring a GameState for the side to move, e.g. a
+    ChessEvaluation.Evaluator with tuned weights; ChessEvaluation.evaluate by default.
+    '''
+    def __init__(self, gs, tt=None, evaluator=None):
+        self.gs = gs
+        self.tt = tt if tt is not None else TranspositionTable()
+        self.evaluate = evaluator if evaluator is not None else evaluate
+        self.nodes = 0
+        self.deadline = None
+        self.node_limit = None
+        self.stop_event = None
+        self.move_buffers = [[] for _ in range(MAX_PLY + 1)]  # noisy moves per ply
+        self.quiet_buffers = [[] for _ in range(MAX_PLY + 1)]
+        self.pv_table = [[] for _ in range(MAX_PLY + 1)]
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history_scores = [[0] * 4096, [0] * 4096]  # [color][start | end << 6]
+
+    def search(self, max_depth=MAX_PLY, time_ms=None, nodes=None, info=None, stop_event=None):
+        '''
+        Iterative deepening until max_depth, time_ms milliseconds or nodes nodes, whichever comes first.
+        info, if given, is called with a SearchResult after every completed iteration.
+        stop_event, a threading.Event, ends the search early from another thread when set.
+        '''
+        gs = self.gs
+        start = time.perf_counter()
+        self.deadline = start + time_ms / 1000.0 if time_ms is not None else None
+        self.node_limit = nodes
+        self.stop_event = stop_event
+        self.nodes = 0
+        for killers in self.killers:
+            killers[0] = killers[1] = 0
+        self.tt.new_search()
+        root_ply = len(gs.move_log)
+
+        root_moves = list(gs.get_valid_move_codes())
+        if not root_moves:
+            score = -MATE_SCORE if gs.in_check else 0
+            return SearchResult(None, score, 0, 0, 0.0, [])
+        result = SearchResult(root_moves[0], 0, 0, 0, 0.0, [root_moves[0]])
+        pv = []
+        for depth in range(1, max_depth + 1):
+            self.root_best = None
+            try:
+                score = self.negamax(depth, -INFINITY, INFINITY, 0, pv)
+            except SearchTimeout:
+                while len(gs.move_log) > root_ply:
+                    gs.undo_move()
+                # the previous best move is searched first, so any root move that beat it is better
+                if self.root_best is not None:
+                    move, result.score = self.root_best
+                    if move != result.best_move:
+                        result.best_move = move
+                        result.pv = [move]
+                break
+            pv = self.extend_pv(list(self.pv_table[0]), depth)
+            result = SearchResult(pv[0], score, depth, self.nodes, time.perf_counter() - start, pv)
+            if info is not None:
+                info(result)
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def extend_pv(self, pv, depth):
+        '''Transposition table cutoffs cut the PV short, follow the stored best moves to finish it.'''
+        gs = self.gs
+        for move in pv:
+            gs.make_move(move)
+        while len(pv) < depth:
+            entry = self.tt.probe(gs.zobrist)
+            if entry is None or not entry[0] or entry[0] not in gs.get_valid_move_codes() or gs.is_repetition():
+                break
+            pv.append(entry[0])
+            gs.make_move(entry[0])
+        for move in pv:
+            gs.undo_move()
+        return pv
+
+    def check_limits(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchTimeout()
+
+    def negamax(self, depth, alpha, beta, ply, pv_line):
+        '''
+        pv_line is the principal variation of the previous iteration while this node is on it,
+        and empty once the search has left it.
+        '''
+        gs = self.gs
+        self.nodes += 1
+        self.check_limits()
+        self.pv_table[ply] = []
+        if ply and (gs.halfmove_clock >= 100 or gs.is_repetition()):
+            return 0
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiesce(alpha, beta, ply)
+
+        key = gs.zobrist
+        entry = self.tt.probe(key)
+        hash_move = 0
+        if entry is not None:
+            hash_move, tt_score, tt_depth, bound = entry
+            if ply and tt_depth >= depth:
+                tt_score = score_from_tt(tt_score, ply)
+                if bound == EXACT or (bound == LOWER and tt_score >= beta) or \
+                        (bound == UPPER and tt_score <= alpha):
+                    return tt_score
+
+        pv_move = pv_line[ply] if ply < len(pv_line) else 0
+        if pv_move:
+            hash_move = pv_move
+
+        alpha_start = alpha
+        best = -INFINITY
+        best_move = 0
+        color = WHITE if gs.white_to_move else BLACK
+        for move in self.staged_moves(ply, hash_move):
+            gs.make_move(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1, pv_line if move == pv_move else ())
+            gs.undo_move()
+            if score > best:
+                best = score
+                best_move = move
+                if ply == 0:
+                    self.root_best = (move, score)
+                if score > alpha:
+                    alpha = score
+                    self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                    if score >= beta:
+                        if not move >> 12 & (CAPTURE | PROMOTION):
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history_scores[color][move & 4095] += depth * depth
+                        break
+        if best == -INFINITY:  # no legal move
+            return -MATE_SCORE + ply if gs.get_checkers() else 0
+        if best >= beta:
+            bound = LOWER
+        elif best > alpha_start:
+            bound = EXACT
+        else:
+            bound = UPPER
+            best_move = 0  # every move failed low, none of them is known to be best
+        self.tt.store(key, best_move, score_to_tt(best, ply), depth, bound)
+        return best
+
+    def quiesce(self, alpha, beta, ply):
+        '''Search captures and promotions only, until the position is quiet.'''
+        gs = self.gs
+        self.nodes += 1
+        self.check_limits()
+        self.pv_table[ply] = []
+        # only a position in check is looked at in full, to find mates; stalemates are left to the main search
+        if gs.get_checkers() and not gs.get_valid_move_codes(self.quiet_buffers[ply]):
+            return -MATE_SCORE + ply
+        stand_pat = self.evaluate(gs)
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        for move in self.staged_moves(ply, 0, True):
+            gs.make_move(move)
+            score = -self.quiesce(-beta, -alpha, ply + 1)
+            gs.undo_move()
+            if score > alpha:
+                alpha = score
+                if score >= beta:
+                    break
+        return alpha
+
+    def staged_moves(self, ply, hash_move=0, captures_only=False):
+        '''
+        Yield the legal moves of the current position in stages: the hash move, captures and
+        promotions by MVV-LVA, the killers, then quiet moves by history score. Each stage is
+        generated only when the one before it is used up, so a cutoff skips the rest.
+        The position must be the same at every resume, i.e. undo each move before the next.
+        '''
+        gs = self.gs
+        if hash_move and gs.is_legal(hash_move):
+            if not captures_only or hash_move >> 12 & (CAPTURE | PROMOTION):
+                yield hash_move
+        else:
+            hash_move = 0
+
+        noisy = gs.get_valid_move_codes(self.move_buffers[ply], GEN_NOISY)
+        if noisy:
+            mailbox = gs.mailbox
+
+            def mvv_lva(move):
+                flags = move >> 12
+                if flags == EN_PASSANT or not flags & CAPTURE:
+                    victim = PAWN  # a quiet promotion is ordered with the pawn captures
+                else:
+                    victim = mailbox[(move >> 6) & 63] % 6
+                value = PIECE_VALUES[victim] * 8 - mailbox[move & 63] % 6
+                if flags & PROMOTION:
+                    value += PIECE_VALUES[PROMOTION_PIECES[flags & 3]]
+                return value
+
+            noisy.sort(key=mvv_lva, reverse=True)
+            for move in noisy:
+                if move != hash_move:
+                    yield move
+        if captures_only:
+            return
+
+        killers = self.killers[ply]
+        killer_1, killer_2 = killers
+        for killer in (killer_1, killer_2):
+            if killer and killer != hash_move and gs.is_legal(killer):
+                yield killer
+
+        quiets = gs.get_valid_move_codes(self.quiet_buffers[ply], GEN_QUIET)
+        history = self.history_scores[WHITE if gs.white_to_move else BLACK]
+        quiets.sort(key=lambda move: history[move & 4095], reverse=True)
+        for move in quiets:
+            if move != hash_move and move != killer_1 and move != killer_2:
+                yield move
+
+
+def find_best_move(gs, depth=MAX_PLY, time_ms=None, nodes=None, info=None, tt=None, evaluator=None):
+    '''Search gs and return a SearchResult. Set at least one of depth, time_ms or nodes.'''
+    return Searcher(gs, tt, evaluator).search(depth, time_ms, nodes, info)
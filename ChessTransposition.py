@@ -0,0 +1,104 @@
+'''
+Fixed-size transposition table keyed by GameState.zobrist_key.
+All entries live in one preallocated array of unsigned 64-bit ints, so memory use is set by
+the size given at construction and never grows over a long session.
+
+Each bucket holds two entries of two words (key, data):
+    slot 0 is depth-preferred: only replaced by a deeper search or when it is from an older search
+    slot 1 is always replaced
+'''
+
+from array import array
+
+EXACT = 1
+LOWER = 2  # score is a lower bound (fail high)
+UPPER = 3  # score is an upper bound (fail low)
+
+DEFAULT_SIZE_MB = 16
+
+_WORDS_PER_BUCKET = 4
+_BYTES_PER_BUCKET = _WORDS_PER_BUCKET * 8
+_SCORE_OFFSET = 1 << 17  # scores are stored biased to fit an unsigned field
+
+# data word: move 16 bits | score 18 bits | depth 8 bits | bound 2 bits | generation 8 bits
+_SCORE_SHIFT = 16
+_DEPTH_SHIFT = 34
+_BOUND_SHIFT = 42
+_GENERATION_SHIFT = 44
+
+
+class TranspositionTable():
+    def __init__(self, size_mb=DEFAULT_SIZE_MB):
+        buckets = 1
+        while buckets * 2 * _BYTES_PER_BUCKET <= size_mb * 1024 * 1024:
+            buckets *= 2
+        self.mask = buckets - 1
+        self.table = array('Q', bytes(buckets * _BYTES_PER_BUCKET))
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    @property
+    def size_bytes(self):
+        return len(self.table) * self.table.itemsize
+
+    def clear(self):
+        self.table = array('Q', [0]) * len(self.table)  # a new zeroed array, not a Python loop over every word
+        self.generation = 0
+        self.probes = self.hits = self.stores = 0
+
+    def new_search(self):
+        '''Age the table, so entries from earlier searches are the first to be replaced.'''
+        self.generation = (self.generation + 1) & 255
+
+    def probe(self, key):
+        '''(move, score, depth, bound) stored for key, or None.'''
+        self.probes += 1
+        table = self.table
+        index = (key & self.mask) * _WORDS_PER_BUCKET
+        if table[index] == key:
+            data = table[index + 1]
+        elif table[index + 2] == key:
+            data = table[index + 3]
+        else:
+            return None
+        if not data:
+            return None
+        self.hits += 1
+        return (data & 0xFFFF,
+                ((data >> _SCORE_SHIFT) & 0x3FFFF) - _SCORE_OFFSET,
+                (data >> _DEPTH_SHIFT) & 0xFF,
+                (data >> _BOUND_SHIFT) & 3)
+
+    def store(self, key, move, score, depth, bound):
+        self.stores += 1
+        table = self.table
+        index = (key & self.mask) * _WORDS_PER_BUCKET
+        data = ((move or 0) & 0xFFFF |
+                (score + _SCORE_OFFSET) << _SCORE_SHIFT |
+                max(depth, 0) << _DEPTH_SHIFT |
+                bound << _BOUND_SHIFT |
+                self.generation << _GENERATION_SHIFT)
+        kept = table[index + 1]
+        if (table[index] == key or not kept or
+                (kept >> _GENERATION_SHIFT) != self.generation or
+                depth >= (kept >> _DEPTH_SHIFT) & 0xFF):
+            if table[index] == key and not move:
+                data |= kept & 0xFFFF  # keep the known best move when this search found none
+            table[index] = key
+            table[index + 1] = data
+        else:
+            table[index + 2] = key
+            table[index + 3] = data
+
+    def hashfull(self):
+        '''Permille of sampled depth-preferred slots filled during the current search.'''
+        table = self.table
+        sample = min(1000, self.mask + 1)
+        used = 0
+        for i in range(sample):
+            data = table[i * _WORDS_PER_BUCKET + 1]
+            if data and (data >> _GENERATION_SHIFT) == self.generation:
+                used += 1
+        return used * 1000 // sample
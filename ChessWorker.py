@@ -0,0 +1,99 @@
+'''
+Engine worker thread, so the pygame loop never waits on a search.
+The UI hands over a copy of the position and the search limits through a queue and polls
+for the results once per frame:
+
+    worker = EngineWorker()
+    worker.start_search(gs, time_ms=1000)
+    ...
+    for kind, result in worker.poll():  # never blocks
+        if kind == BESTMOVE:
+            gs.make_move(result.best_move)
+
+Starting a new search or calling cancel() stops the running one; results of a cancelled
+search are never returned by poll(). A search that raises ends with an ERROR message instead
+of BESTMOVE, and the worker carries on with the next request.
+'''
+
+import queue
+import threading
+import traceback
+
+import ChessSearch
+from ChessTransposition import DEFAULT_SIZE_MB, TranspositionTable
+
+INFO = "info"  # a finished iteration, result is a ChessSearch.SearchResult
+BESTMOVE = "bestmove"  # the search is over, result is the final SearchResult
+ERROR = "error"  # the search failed, result is the exception
+
+
+class EngineWorker():
+    def __init__(self, tt_size_mb=DEFAULT_SIZE_MB, evaluator=None):
+        self.evaluator = evaluator  # None for ChessEvaluation.evaluate
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.tt = TranspositionTable(tt_size_mb)  # only touched by the worker thread
+        self.request_id = 0
+        self.active_stop = None  # stop event of the latest request
+        self.thread = threading.Thread(target=self.run, name="EngineWorker", daemon=True)
+        self.thread.start()
+
+    @property
+    def thinking(self):
+        '''True from start_search() until its best move has been polled or it is cancelled.'''
+        return self.active_stop is not None
+
+    def start_search(self, gs, depth=ChessSearch.MAX_PLY, time_ms=None, nodes=None):
+        '''Queue a search of a copy of gs, cancelling any search still running. Returns the request id.'''
+        self.cancel()
+        self.request_id += 1
+        self.active_stop = threading.Event()
+        self.requests.put((self.request_id, gs.copy(), depth, time_ms, nodes, self.active_stop))
+        return self.request_id
+
+    def cancel(self):
+        if self.active_stop is not None:
+            self.active_stop.set()
+            self.active_stop = None
+
+    def poll(self):
+        '''(kind, result) messages of the current search that arrived since the last poll.'''
+        messages = []
+        while True:
+            try:
+                request_id, kind, result = self.results.get_nowait()
+            except queue.Empty:
+                return messages
+            if request_id != self.request_id or self.active_stop is None:
+                continue  # from a cancelled search
+            messages.append((kind, result))
+            if kind == BESTMOVE or kind == ERROR:
+                self.active_stop = None
+
+    def stop(self):
+        '''Cancel the search and end the thread.'''
+        self.cancel()
+        self.requests.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            request_id, gs, depth, time_ms, nodes, stop_event = request
+            if stop_event.is_set():
+                continue
+
+            def info(result, request_id=request_id):
+                self.results.put((request_id, INFO, result))
+
+            gs.move_cache = None  # the copy shares the UI's cache, which the staged search would not use
+            try:
+                searcher = ChessSearch.Searcher(gs, self.tt, self.evaluator)
+                result = searcher.search(depth, time_ms, nodes, info, stop_event)
+            except Exception as error:
+                traceback.print_exc()
+                self.results.put((request_id, ERROR, error))
+            else:
+                self.results.put((request_id, BESTMOVE, result))